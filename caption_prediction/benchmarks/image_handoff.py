@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(current_dir))
+
+from precompute_embeddings import (
+    current_dir as app_dir,
+    encode_images,
+    image_preparer,
+    load_image_ids,
+    load_scorer,
+    read_batch,
+    resolve_handoff,
+)
+
+HANDOFFS = ("base64", "direct")
+
+
+def time_handoff(batches, scorer, handoff, repeat):
+    """Embeddings of all batches of raw image bytes and the best of
+    ``repeat`` timed passes, each preparing and encoding every batch."""
+    prepare = image_preparer(scorer, handoff)
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        embeddings = [
+            encode_images([prepare(data) for data in images], scorer, handoff)
+            for images in batches
+        ]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return np.concatenate(embeddings), best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare MedImageInsight image embeddings and throughput of "
+        "the base64 and direct image hand-off of precompute_embeddings.py."
+    )
+    parser.add_argument(
+        "--dataset",
+        choices=["valid", "test"],
+        default="valid",
+        help="Split whose images are encoded (default: valid).",
+    )
+    parser.add_argument(
+        "--images",
+        type=int,
+        default=256,
+        help="Number of images from the start of the split (default: 256).",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=32, help="Images per batch (default: 32)."
+    )
+    parser.add_argument(
+        "--device",
+        choices=["auto", "cuda", "cpu"],
+        default="auto",
+        help="Device for MedImageInsight (default: cuda if available, else cpu).",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Timed passes per hand-off; the fastest counts (default: 3).",
+    )
+    parser.add_argument(
+        "--atol",
+        type=float,
+        default=0.0,
+        help="Largest allowed absolute difference between the embeddings "
+        "(default: 0, identical).",
+    )
+    args = parser.parse_args()
+
+    import torch
+
+    device = args.device
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    scorer = load_scorer(device)
+    if resolve_handoff(scorer, "direct") != "direct":
+        sys.exit(1)
+
+    image_dir = os.path.join(app_dir, f"data/{args.dataset}/images")
+    image_ids = load_image_ids(args.dataset)[: args.images]
+    paths = [os.path.join(image_dir, image_id + ".jpg") for image_id in image_ids]
+    batches = [
+        read_batch(paths[start : start + args.batch_size])[0]
+        for start in range(0, len(paths), args.batch_size)
+    ]
+    # Warm up the model so neither hand-off pays for first-call setup
+    time_handoff(batches[:1], scorer, "direct", 1)
+
+    results = {}
+    print("\nHand-off,Images,Seconds,Images/sec")
+    for handoff in HANDOFFS:
+        embeddings, seconds = time_handoff(batches, scorer, handoff, args.repeat)
+        results[handoff] = embeddings
+        print(f"{handoff},{len(paths)},{seconds:.3f},{len(paths) / seconds:.1f}")
+
+    difference = float(np.max(np.abs(results["direct"] - results["base64"])))
+    identical = np.array_equal(results["direct"], results["base64"])
+    print(
+        f"\nEmbeddings {'identical' if identical else 'differ'}: "
+        f"max abs difference {difference:.3g}"
+    )
+    if difference > args.atol:
+        print(f"Difference exceeds --atol {args.atol}.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
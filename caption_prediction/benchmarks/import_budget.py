@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Modules the entry points must not load before a submission is checked
+HEAVY_MODULES = (
+    "torch",
+    "transformers",
+    "alignscore",
+    "bert_score",
+    "bleurt_pytorch",
+    "medcat",
+    "medimageinsightmodel",
+)
+ENTRY_POINTS = ("run_evaluation", "evaluation_server", "evaluator")
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure(module):
+    # A fresh interpreter per module, so nothing is imported already
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module)],
+        cwd=os.path.dirname(current_dir),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that the evaluation entry points import quickly and "
+        "without loading torch or the model packages."
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=1.0,
+        help="Maximum import time per entry point in seconds (default: 1.0).",
+    )
+    args = parser.parse_args()
+
+    failures = []
+    for module in ENTRY_POINTS:
+        result = measure(module)
+        heavy = [
+            name
+            for name in HEAVY_MODULES
+            if any(m == name or m.startswith(name + ".") for m in result["modules"])
+        ]
+        print(f"{module}: {result['seconds']:.3f}s")
+        if result["seconds"] > args.budget:
+            failures.append(f"{module} took {result['seconds']:.3f}s > {args.budget}s")
+        if heavy:
+            failures.append(f"{module} imports {', '.join(heavy)}")
+    if failures:
+        print("\n".join(["", "Import budget exceeded:"] + failures))
+        sys.exit(1)
+    print("All entry points within the import budget.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(current_dir))
+
+from synthetic import generate_dataset
+from stub_models import install_stub_models
+
+DEFAULT_BASELINE = os.path.join(current_dir, "baseline.json")
+
+
+def parse_size(value):
+    value = value.lower()
+    if value.endswith("k"):
+        return int(value[:-1]) * 1000
+    return int(value)
+
+
+def run_size(size, args):
+    from evaluator import CaptionEvaluator
+
+    ground_truth_path, submission_path, embeddings_dir = generate_dataset(
+        os.path.join(args.workdir, str(size)), size, dim=args.dim
+    )
+    evaluator = CaptionEvaluator(
+        ground_truth_path=ground_truth_path,
+        embeddings_dir=embeddings_dir,
+        concurrent=False,
+    )
+    if not args.real:
+        install_stub_models(evaluator, dim=args.dim)
+    evaluator._evaluate({"submission_file_path": submission_path}, metrics=args.metrics)
+    return evaluator.last_profile
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    regressions = []
+    print("\nRun,Stage,Baseline s,Current s,Change")
+    for run, profile in results.items():
+        for stage, record in profile["stages"].items():
+            base = baseline.get(run, {}).get("stages", {}).get(stage)
+            if base is None:
+                continue
+            change = (
+                record["wall_seconds"] / base["wall_seconds"] - 1
+                if base["wall_seconds"]
+                else 0.0
+            )
+            print(
+                f"{run},{stage},{base['wall_seconds']},{record['wall_seconds']},"
+                f"{100 * change:+.1f}%"
+            )
+            if (
+                change > tolerance
+                and record["wall_seconds"] - base["wall_seconds"] > min_seconds
+            ):
+                regressions.append((run, stage, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the caption evaluator on synthetic data and "
+        "compare per-stage timings against a stored baseline."
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=parse_size,
+        default=[1000, 10000],
+        help="Synthetic dataset sizes, e.g. 1k 10k 100k (default: 1k 10k).",
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        choices=["bert", "align", "rouge", "similarity", "bleurt", "medcat"],
+        help="Metrics to run (default: all).",
+    )
+    parser.add_argument(
+        "--real",
+        action="store_true",
+        help="Use the real models instead of the stubs (needs the full image).",
+    )
+    parser.add_argument(
+        "--dim", type=int, default=1024, help="Embedding dimension (default: 1024)."
+    )
+    parser.add_argument(
+        "--workdir",
+        default=os.path.join(tempfile.gettempdir(), "caption_benchmarks"),
+        help="Where synthetic datasets are generated and reused.",
+    )
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON.")
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store this run as the new baseline instead of comparing.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed slowdown per stage before it counts as a regression "
+        "(default: 0.2 = 20%%).",
+    )
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=0.05,
+        help="Ignore slowdowns smaller than this many seconds (default: 0.05).",
+    )
+    parser.add_argument("--output", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    # Measure the pipeline, not cache lookups or checkpoint resumes
+    os.environ.pop("SCORE_CACHE_PATH", None)
+    os.environ.pop("EVAL_CHECKPOINT_DIR", None)
+    mode = "real" if args.real else "stub"
+    results = {f"{mode}/{size}": run_size(size, args) for size in args.sizes}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\nBaseline for {', '.join(results)} written to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline first.")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+    if regressions:
+        print("\nRegressions:")
+        for run, stage, change in regressions:
+            print(f"{run} {stage}: {100 * change:+.1f}%")
+        sys.exit(1)
+    print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+import csv
+import random
+import numpy as np
+
+FINDINGS = [
+    "opacity",
+    "consolidation",
+    "effusion",
+    "pneumothorax",
+    "nodule",
+    "mass",
+    "fracture",
+    "lesion",
+    "stenosis",
+    "aneurysm",
+    "thrombus",
+    "hematoma",
+    "calcification",
+    "atelectasis",
+    "edema",
+    "cyst",
+    "abscess",
+    "infiltrate",
+    "dilatation",
+    "occlusion",
+    "metastasis",
+    "collection",
+    "enhancement",
+]
+MODIFIERS = [
+    "large",
+    "small",
+    "left",
+    "right",
+    "bilateral",
+    "hyperdense",
+    "hypodense",
+    "heterogeneous",
+    "well-defined",
+    "ill-defined",
+    "multiple",
+    "solitary",
+    "mild",
+    "severe",
+    "acute",
+    "chronic",
+    "irregular",
+    "lobulated",
+]
+SITES = [
+    "lung",
+    "liver",
+    "kidney",
+    "spleen",
+    "pancreas",
+    "brain",
+    "spine",
+    "femur",
+    "aorta",
+    "pleura",
+    "bladder",
+    "gallbladder",
+    "thyroid",
+    "heart",
+    "colon",
+]
+MODALITIES = [
+    "Computed tomography",
+    "Axial CT",
+    "Chest X-ray",
+    "MRI T2-weighted image",
+    "Ultrasound",
+    "Coronal CT",
+    "Contrast-enhanced CT",
+    "Sagittal MRI",
+]
+# Generic captions that many submissions repeat verbatim
+GENERIC = ["Chest X-ray.", "CT scan of the abdomen.", "MRI of the brain."]
+
+
+def random_caption(rng):
+    clauses = []
+    for _ in range(rng.randint(1, 4)):
+        clauses.append(
+            "{} {} in the {} {}".format(
+                rng.choice(MODIFIERS),
+                rng.choice(FINDINGS),
+                rng.choice(MODIFIERS[2:5]),
+                rng.choice(SITES),
+            )
+        )
+        if rng.random() < 0.3:
+            clauses[-1] += f" measuring {rng.randint(1, 99)} mm"
+    return f"{rng.choice(MODALITIES)} showing " + ", ".join(clauses) + "."
+
+
+def perturb(caption, rng):
+    words = caption.split()
+    for _ in range(rng.randint(1, max(1, len(words) // 4))):
+        idx = rng.randrange(len(words))
+        choice = rng.random()
+        if choice < 0.4 and len(words) > 3:
+            del words[idx]
+        elif choice < 0.8:
+            words[idx] = rng.choice(FINDINGS + MODIFIERS + SITES)
+        else:
+            words.insert(idx, rng.choice(MODIFIERS))
+    return " ".join(words)
+
+
+def generate_pairs(size, seed=0):
+    """Ground truth and submission captions for ``size`` synthetic images.
+
+    The submission mixes exact copies of the ground truth, perturbed copies,
+    repeated generic captions and empty captions, so deduplication, caching
+    and the empty-pair rules are exercised like on real runs.
+    """
+    rng = random.Random(seed)
+    ids = [f"synthetic_{i:07d}" for i in range(size)]
+    gt = {}
+    predictions = {}
+    for image_id in ids:
+        caption = "" if rng.random() < 0.01 else random_caption(rng)
+        gt[image_id] = caption
+        choice = rng.random()
+        if choice < 0.2:
+            predictions[image_id] = caption
+        elif choice < 0.35:
+            predictions[image_id] = rng.choice(GENERIC)
+        elif choice < 0.4:
+            predictions[image_id] = ""
+        elif caption:
+            predictions[image_id] = perturb(caption, rng)
+        else:
+            predictions[image_id] = random_caption(rng)
+    return gt, predictions
+
+
+def write_captions(path, pairs):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ID", "Caption"])
+        writer.writerows(pairs.items())
+
+
+def generate_dataset(directory, size, dataset_type="valid", dim=1024, seed=0):
+    """Write data/<dataset_type>/captions.csv, submission.csv and a random
+    embedding store under ``directory``; existing files are reused.
+
+    Returns (ground truth path, submission path, embeddings directory).
+    """
+    from embedding_store import save_embedding_store, store_paths
+
+    ground_truth_path = os.path.join(directory, "data", dataset_type, "captions.csv")
+    submission_path = os.path.join(directory, "submission.csv")
+    embeddings_dir = os.path.join(directory, "precomputed")
+    if not all(
+        os.path.exists(path)
+        for path in (
+            ground_truth_path,
+            submission_path,
+            store_paths(dataset_type, embeddings_dir)[1],
+        )
+    ):
+        print(f"Generating {size} synthetic captions in {directory}")
+        gt, predictions = generate_pairs(size, seed)
+        write_captions(ground_truth_path, gt)
+        write_captions(submission_path, predictions)
+        matrix = np.random.default_rng(seed).standard_normal(
+            (size, dim), dtype=np.float32
+        )
+        save_embedding_store(dataset_type, list(gt), matrix, embeddings_dir)
+    return ground_truth_path, submission_path, embeddings_dir
@@ -0,0 +1,101 @@
+import os
+import json
+import shutil
+import hashlib
+from file_hash import file_sha256
+
+
+class Checkpoint:
+    """Per-image metric scores of one submission, persisted during evaluation.
+
+    Scores are appended to ``<metric>.progress.jsonl`` after every chunk of
+    images and moved to ``<metric>.json`` once the metric is complete. Each
+    record carries the metric's model identifier, so scores from another
+    model or precision are never reused. A torn last line from a crash is
+    ignored.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def for_submission(cls, root, submission_path, ground_truth_path):
+        digest = hashlib.sha256()
+        for path in (submission_path, ground_truth_path):
+            digest.update(file_sha256(path).encode())
+        return cls(os.path.join(root, digest.hexdigest()[:16]))
+
+    def _path(self, metric, suffix):
+        return os.path.join(self.directory, metric + suffix)
+
+    def load(self, metric, model_id):
+        """{image_id: score} of the images already scored for ``metric``."""
+        complete_path = self._path(metric, ".json")
+        if os.path.exists(complete_path):
+            with open(complete_path) as f:
+                record = json.load(f)
+            if record["model"] == model_id:
+                return record["scores"]
+        scores = {}
+        progress_path = self._path(metric, ".progress.jsonl")
+        if os.path.exists(progress_path):
+            with open(progress_path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    if record["model"] == model_id:
+                        scores.update(record["scores"])
+        return scores
+
+    def append(self, metric, model_id, scores):
+        with open(self._path(metric, ".progress.jsonl"), "a") as f:
+            f.write(json.dumps({"model": model_id, "scores": scores}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def complete(self, metric, model_id, scores):
+        complete_path = self._path(metric, ".json")
+        with open(complete_path + ".tmp", "w") as f:
+            json.dump({"model": model_id, "scores": scores}, f)
+        os.replace(complete_path + ".tmp", complete_path)
+        progress_path = self._path(metric, ".progress.jsonl")
+        if os.path.exists(progress_path):
+            os.remove(progress_path)
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def scores(self, metric, model_id, candidate_pairs, score_fn, chunk_size=1000):
+        """Per-image scores in ``candidate_pairs`` order, computing only the
+        images without a checkpointed score, ``chunk_size`` at a time.
+
+        ``score_fn`` sees one chunk per call, so deduplication, batching and
+        length bucketing inside the scorers are limited to a chunk, and
+        MedCAT restarts its worker processes for each one.
+        """
+        done = self.load(metric, model_id)
+        remaining = [
+            image_key for image_key in candidate_pairs if image_key not in done
+        ]
+        if len(remaining) < len(candidate_pairs):
+            print(
+                f"Checkpoint {metric}: resuming with "
+                f"{len(candidate_pairs) - len(remaining)} of {len(candidate_pairs)} "
+                "images already scored"
+            )
+        chunk_size = max(1, chunk_size)
+        for start in range(0, len(remaining), chunk_size):
+            keys = remaining[start : start + chunk_size]
+            chunk_scores = score_fn(
+                {image_key: candidate_pairs[image_key] for image_key in keys}
+            )
+            new_scores = {
+                image_key: float(score) for image_key, score in zip(keys, chunk_scores)
+            }
+            self.append(metric, model_id, new_scores)
+            done.update(new_scores)
+        self.complete(metric, model_id, done)
+        return [done[image_key] for image_key in candidate_pairs]
@@ -0,0 +1,157 @@
+import os
+import glob
+import json
+import hashlib
+import argparse
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+PRECOMPUTED_DIR = os.path.join(current_dir, "precomputed")
+
+
+class EmbeddingStore:
+    """Image embeddings as one (N, D) matrix plus an image ID -> row index.
+
+    The matrix is usually a read-only memory map, so opening a store does not
+    read the embeddings; rows are gathered on demand with fancy indexing.
+    ``hashes`` maps image IDs to the SHA-256 of the image file each embedding
+    was computed from, where known.
+    """
+
+    def __init__(self, ids, matrix, hashes=None):
+        self.ids = list(ids)
+        self.matrix = matrix
+        self.hashes = hashes or {}
+        self.index = {image_id: row for row, image_id in enumerate(self.ids)}
+
+    def __contains__(self, image_id):
+        return image_id in self.index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, image_id):
+        return self.matrix[self.index[image_id]]
+
+    def rows(self, image_ids):
+        return self.matrix[[self.index[image_id] for image_id in image_ids]]
+
+
+def store_paths(dataset_type, directory=PRECOMPUTED_DIR):
+    base = os.path.join(directory, f"image_embeddings_{dataset_type}")
+    return base + ".npy", base + ".json"
+
+
+def legacy_store_path(dataset_type, directory=PRECOMPUTED_DIR):
+    return os.path.join(directory, f"image_embeddings_{dataset_type}.npz")
+
+
+def save_embedding_store(
+    dataset_type, ids, matrix, directory=PRECOMPUTED_DIR, hashes=None
+):
+    os.makedirs(directory, exist_ok=True)
+    base_path, index_path = store_paths(dataset_type, directory)
+    matrix = np.ascontiguousarray(matrix)
+    ids = list(ids)
+    if len(ids) != len(matrix):
+        raise ValueError(f"{len(ids)} image IDs for {len(matrix)} embedding rows.")
+    # Each matrix is written under a name derived from its contents and the
+    # index names the matrix it belongs to. Replacing the index is the only
+    # step that switches stores, so an interrupted save leaves the old index
+    # with its old matrix, never with rows it does not describe.
+    version = hashlib.sha256(matrix.tobytes()).hexdigest()[:16]
+    matrix_path = f"{base_path[: -len('.npy')]}.{version}.npy"
+    with open(matrix_path + ".tmp", "wb") as f:
+        np.save(f, matrix)
+    os.replace(matrix_path + ".tmp", matrix_path)
+    index = {"matrix": os.path.basename(matrix_path), "rows": len(ids), "ids": ids}
+    if hashes:
+        index["sha256"] = [hashes.get(image_id) for image_id in ids]
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(index_path + ".tmp", index_path)
+    # Drop matrices no index names any more, including those of earlier
+    # interrupted saves
+    stale = glob.glob(f"{base_path[: -len('.npy')]}.*.npy") + [base_path]
+    for path in stale:
+        if path != matrix_path and os.path.exists(path):
+            os.remove(path)
+    return matrix_path
+
+
+def _index_matrix_path(index_path, index=None):
+    # Stores written before matrices were versioned name no matrix and use
+    # image_embeddings_<split>.npy
+    if index is None:
+        with open(index_path) as f:
+            index = json.load(f)
+    name = index.get("matrix")
+    if name is None:
+        return index_path[: -len(".json")] + ".npy"
+    return os.path.join(os.path.dirname(index_path), name)
+
+
+def load_embedding_store(dataset_type, directory=PRECOMPUTED_DIR):
+    _, index_path = store_paths(dataset_type, directory)
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        matrix_path = _index_matrix_path(index_path, index)
+        if not os.path.exists(matrix_path):
+            raise ValueError(
+                f"Embedding index {index_path} names {matrix_path}, which is missing."
+            )
+        matrix = np.load(matrix_path, mmap_mode="r")
+        rows = index.get("rows", len(index["ids"]))
+        if rows != len(index["ids"]) or rows != len(matrix):
+            raise ValueError(
+                f"Embedding index {index_path} lists {len(index['ids'])} images "
+                f"but {matrix_path} has {len(matrix)} rows; recompute the embeddings."
+            )
+        hashes = {
+            image_id: digest
+            for image_id, digest in zip(index["ids"], index.get("sha256", []))
+            if digest
+        }
+        return EmbeddingStore(index["ids"], matrix, hashes)
+    legacy_path = legacy_store_path(dataset_type, directory)
+    if os.path.exists(legacy_path):
+        print(
+            f"Reading legacy embeddings from {legacy_path}; run "
+            f"`python embedding_store.py --convert {dataset_type}` to convert them."
+        )
+        return _load_legacy_store(legacy_path)
+    return None
+
+
+def _load_legacy_store(legacy_path):
+    data = np.load(legacy_path)
+    ids = list(data.files)
+    return EmbeddingStore(ids, np.stack([data[image_id] for image_id in ids]))
+
+
+def convert_legacy_store(dataset_type, directory=PRECOMPUTED_DIR):
+    legacy_path = legacy_store_path(dataset_type, directory)
+    if not os.path.exists(legacy_path):
+        raise FileNotFoundError(f"Legacy embeddings not found at {legacy_path}")
+    store = _load_legacy_store(legacy_path)
+    matrix_path = save_embedding_store(dataset_type, store.ids, store.matrix, directory)
+    print(f"Converted {len(store)} embeddings from {legacy_path} to {matrix_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert legacy .npz image embeddings to the memory-mapped store."
+    )
+    parser.add_argument(
+        "--convert",
+        choices=["valid", "test"],
+        required=True,
+        help="Dataset whose image_embeddings_<dataset>.npz should be converted.",
+    )
+    args = parser.parse_args()
+    convert_legacy_store(args.convert)
+
+
+if __name__ == "__main__":
+    main()
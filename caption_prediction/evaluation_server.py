@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import uuid
+import queue
+import argparse
+import threading
+import traceback
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from evaluator import CaptionEvaluator
+from submission_check import check_submission, SubmissionFormatError
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class EvaluationService:
+    """Queues submissions and evaluates them one at a time with a single,
+    long-lived CaptionEvaluator so models stay loaded between jobs."""
+
+    def __init__(self, evaluator, dataset_type):
+        self.evaluator = evaluator
+        self.dataset_type = dataset_type
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, submission_file_path, metrics=None):
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "submission_file_path": submission_file_path,
+            "metrics": metrics,
+            "status": "queued",
+            "result": None,
+            "profile": None,
+            "error": None,
+            "timings": {"queued_at": time.time()},
+        }
+        with self.lock:
+            self.jobs[job_id] = job
+        self.queue.put(job_id)
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = dict(job, timings=dict(job["timings"]))
+        snapshot["queue_position"] = self._queue_position(job_id)
+        return snapshot
+
+    def list(self):
+        with self.lock:
+            job_ids = list(self.jobs)
+        return [self.get(job_id) for job_id in job_ids]
+
+    def _queue_position(self, job_id):
+        with self.queue.mutex:
+            pending = list(self.queue.queue)
+        return pending.index(job_id) + 1 if job_id in pending else 0
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            timings = fields.pop("timings", {})
+            self.jobs[job_id].update(fields)
+            self.jobs[job_id]["timings"].update(timings)
+
+    def _run(self):
+        while True:
+            job_id = self.queue.get()
+            submission_file_path = self.jobs[job_id]["submission_file_path"]
+            metrics = self.jobs[job_id]["metrics"]
+            started = time.time()
+            self._update(job_id, status="checking", timings={"started_at": started})
+            try:
+                check_submission(
+                    submission_path=submission_file_path,
+                    ground_truth_path=self.evaluator.ground_truth_path,
+                    dataset_type=self.dataset_type,
+                )
+                checked = time.time()
+                self._update(
+                    job_id,
+                    status="running",
+                    timings={"check_seconds": checked - started},
+                )
+                result = self.evaluator._evaluate(
+                    {"submission_file_path": submission_file_path}, {}, metrics=metrics
+                )
+                self._update(
+                    job_id,
+                    status="done",
+                    result=result,
+                    profile=self.evaluator.last_profile,
+                    timings={"evaluation_seconds": time.time() - checked},
+                )
+            except SubmissionFormatError as e:
+                self._update(job_id, status="failed", error=str(e))
+            except Exception:
+                traceback.print_exc()
+                self._update(job_id, status="failed", error=traceback.format_exc())
+            finally:
+                finished = time.time()
+                queued_at = self.jobs[job_id]["timings"]["queued_at"]
+                self._update(
+                    job_id,
+                    timings={
+                        "finished_at": finished,
+                        "queue_seconds": started - queued_at,
+                        "total_seconds": finished - queued_at,
+                    },
+                )
+                self.queue.task_done()
+
+
+class EvaluationRequestHandler(BaseHTTPRequestHandler):
+    # POST /jobs                {"submission_file_path": "...",
+    #                            "metrics": ["rouge", ...] (optional)} -> job
+    # GET  /jobs                -> all jobs
+    # GET  /jobs/<id>           -> job status, timings and result
+    # GET  /health              -> {"status": "ok"}
+    service = None
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        if path == "/health":
+            self._send(200, {"status": "ok", "dataset": self.service.dataset_type})
+        elif path == "/jobs":
+            self._send(200, self.service.list())
+        elif path.startswith("/jobs/"):
+            job = self.service.get(path[len("/jobs/") :])
+            if job is None:
+                self._send(404, {"error": "Unknown job ID."})
+            else:
+                self._send(200, job)
+        else:
+            self._send(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self._send(404, {"error": f"Unknown path: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            submission_file_path = payload["submission_file_path"]
+            metrics = payload.get("metrics")
+        except (ValueError, KeyError, TypeError):
+            self._send(
+                400, {"error": 'Expected a JSON body {"submission_file_path": "..."}.'}
+            )
+            return
+        if not os.path.exists(submission_file_path):
+            self._send(
+                400, {"error": f"Submission file not found at {submission_file_path}"}
+            )
+            return
+        self._send(202, self.service.submit(submission_file_path, metrics))
+
+    def address_string(self):
+        # Unix socket clients have no (host, port) address
+        if isinstance(self.client_address, tuple) and self.client_address:
+            return str(self.client_address[0])
+        return "unix"
+
+    def _send(self, status, body):
+        data = json.dumps(body, indent=2, default=float).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ThreadingUnixHTTPServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve caption evaluations with models kept in memory."
+    )
+    parser.add_argument("dataset", choices=["valid", "test"], help="Dataset split.")
+    parser.add_argument("--host", default="127.0.0.1", help="HTTP host to bind.")
+    parser.add_argument("--port", type=int, default=8080, help="HTTP port to bind.")
+    parser.add_argument(
+        "--unix-socket",
+        help="Listen on this Unix socket path instead of a TCP port.",
+    )
+    args = parser.parse_args()
+
+    ground_truth_path = os.path.join(current_dir, f"data/{args.dataset}/captions.csv")
+    if not os.path.exists(ground_truth_path):
+        print(f"Error: Ground truth file not found at {ground_truth_path}")
+        raise SystemExit(1)
+
+    evaluator = CaptionEvaluator(ground_truth_path=ground_truth_path, keep_models=True)
+    EvaluationRequestHandler.service = EvaluationService(evaluator, args.dataset)
+
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        server = ThreadingUnixHTTPServer(args.unix_socket, EvaluationRequestHandler)
+        print(f"Serving {args.dataset} evaluations on unix:{args.unix_socket}")
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), EvaluationRequestHandler)
+        print(f"Serving {args.dataset} evaluations on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        evaluator.close()
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,99 +1,280 @@
 import os
+import contextlib
+import hashlib
 import sys
 import csv
 import string
 import numpy as np
 import re
-import evaluate
 from tqdm import tqdm
-from alignscore import AlignScore
-from bert_score import BERTScorer
-from medcat_scorer import MedCatScorer
-import torch
-from bleurt_pytorch import (
-    BleurtConfig,
-    BleurtForSequenceClassification,
-    BleurtTokenizer,
+from medcat_scorer import (
+    MedCatScorer,
+    default_model_path,
+    gt_cache_path,
+    load_gt_cuis,
 )
+from rouge1_scorer import Rouge1Scorer
+from embedding_store import PRECOMPUTED_DIR, load_embedding_store, store_paths
+from score_cache import ScoreCache
+from checkpoint import Checkpoint
+from file_hash import file_sha256
+from metric_scheduler import METRIC_MEMORY_MB, MetricScheduler
+from model_registry import ModelRegistry
+from instrumentation import Profiler, print_profile
+
+# torch and the model packages are imported where they are first needed, so
+# importing this module stays cheap and a submission that fails the format
+# check (run before the evaluator is created) is reported right away.
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Construct paths to the module directories
 med_image_insights_dir = os.path.join(CURRENT_DIR, "MedImageInsights")
 
-# check if the directory exist
-if not os.path.exists(med_image_insights_dir):
-    raise Exception(
-        "MedImageInsights directory not found at {}".format(med_image_insights_dir)
-    )
 
-sys.path.insert(0, med_image_insights_dir)
-
-from medimageinsightmodel import MedImageInsight
+def _length_batches(lengths, batch_size, max_tokens=0):
+    """Group indices by length so each batch pads to similar sizes.
+
+    Batches hold at most ``batch_size`` items, or, when ``max_tokens`` is
+    set, as many items as fit ``longest * count <= max_tokens``.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    current = []
+    longest = 0
+    for idx in order:
+        length = max(1, lengths[idx])
+        if current:
+            if max_tokens > 0:
+                full = max(longest, length) * (len(current) + 1) > max_tokens
+            else:
+                full = len(current) >= batch_size
+            if full:
+                batches.append(current)
+                current = []
+                longest = 0
+        current.append(idx)
+        longest = max(longest, length)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _cpu_supports_bf16():
+    import torch
+
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except Exception:
+        return False
+
+
+def _dedup(items, label):
+    """Return the unique items and, for each item, its index among them."""
+    positions = {}
+    inverse = [positions.setdefault(item, len(positions)) for item in items]
+    if items:
+        print(
+            f"{label} dedup: {len(items)} -> {len(positions)} unique "
+            f"({100.0 * (1 - len(positions) / len(items)):.1f}% skipped)"
+        )
+    return list(positions), inverse
 
 
 class CaptionEvaluator:
     case_sensitive = False
+    # Result key -> (label, compute method, per-image score method). Metrics
+    # with a model register its loader in the model registry under the same key.
+    METRICS = {
+        "bert": ("BERTScore", "compute_bertscore", "_bertscore_scores"),
+        "align": ("AlignScore", "compute_alignscore", "_alignscore_scores"),
+        "rouge": ("ROUGE", "compute_rouge", "_rouge_scores"),
+        "similarity": (
+            "Image-Caption Similarity",
+            "compute_similarity",
+            "_similarity_scores",
+        ),
+        "bleurt": ("BLEURT", "compute_bleurt", "_bleurt_scores"),
+        "medcat": ("MedCAT", "compute_medcats", "_medcat_scores"),
+    }
+    # Metrics averaged into the primary (relevance) and secondary
+    # (factuality) scores
+    RELEVANCE_METRICS = ("bert", "rouge", "similarity", "bleurt")
+    FACTUALITY_METRICS = ("medcat", "align")
+    # Metrics backed by a torch model that EVAL_PRECISION applies to
+    TORCH_METRICS = ("bert", "align", "similarity", "bleurt")
+    # Identifies the model and settings behind each metric's cached scores
+    MODEL_IDS = {
+        "bert": "microsoft/deberta-xlarge-mnli:idf",
+        "align": "roberta-large:AlignScore-base.ckpt:nli_sp",
+        "rouge": "rouge1",
+        "similarity": "MedImageInsights/2024.09.27",
+        "bleurt": "lucadiliello/BLEURT-20-D12",
+        "medcat": "medcat",
+    }
 
     def __init__(self, ground_truth_path="/app/data/valid/captions.csv", **kwargs):
         print("Initializing evaluator...")
         self.ground_truth_path = ground_truth_path
         self.dataset_type = os.path.basename(os.path.dirname(self.ground_truth_path))
-        self.gt = self.load_gt()
+        # Long-lived callers (e.g. the evaluation server) keep models resident
+        # between metrics instead of freeing GPU memory after each one.
+        self.keep_models = kwargs.get("keep_models", False)
+        # Per-stage timings and memory of the last evaluation, see
+        # instrumentation.py; load_gt is kept across evaluations.
+        self.profiler = Profiler()
+        self.last_profile = None
+        with self.profiler.stage("load_gt") as record:
+            self.gt = self.load_gt()
+            record["items"] = len(self.gt)
+        import torch
+
         if torch.cuda.is_available():
             self.device = "cuda"
         else:
             self.device = "cpu"
+        self.precision = self._resolve_precision(
+            kwargs.get("precision") or os.environ.get("EVAL_PRECISION", "fp32")
+        )
         self.text_batch_size = int(os.environ.get("TEXT_BATCH_SIZE", "8"))
-        print("Loading ROUGE from HuggingFace")
-        self.scorers = {
-            "rouge": (evaluate.load("rouge"),),
-        }
-        print("Loading MedCatScorer")
-        self.medcat_scorer = MedCatScorer(
-            model_path=os.path.join(
-                CURRENT_DIR
-            ,
-                [
-                    os.path.join("models/MedCAT", filename)
-                    for filename in os.listdir("models/MedCAT")
-                    if filename.endswith(".zip")
-                ][0],
+        self.text_batch_max_tokens = int(os.environ.get("TEXT_BATCH_MAX_TOKENS", "0"))
+        self.text_batch_by_length = os.environ.get("TEXT_BATCH_BY_LENGTH", "0") == "1"
+        self.bertscore_batched = os.environ.get("BERTSCORE_BATCHED", "1") != "0"
+        # bert_score keeps the token embeddings of every sentence in a score()
+        # call until it returns, so calls are capped to bound peak memory
+        self.bertscore_call_pairs = int(os.environ.get("BERTSCORE_CALL_PAIRS", "2000"))
+        # Run independent metrics concurrently (see metric_scheduler.py)
+        self.concurrent = kwargs.get(
+            "concurrent", os.environ.get("EVAL_CONCURRENT", "0") == "1"
+        )
+        # Metrics computed by default; all unless EVAL_METRICS names a subset
+        self.metrics = self._select_metrics(
+            kwargs.get("metrics")
+            or os.environ.get("EVAL_METRICS")
+            or list(self.METRICS)
+        )
+        self._scheduler = None
+        self.score_cache = None
+        if os.environ.get("SCORE_CACHE_PATH"):
+            self.score_cache = ScoreCache(
+                os.environ["SCORE_CACHE_PATH"],
+                max_entries=int(os.environ.get("SCORE_CACHE_MAX_ENTRIES", "1000000")),
             )
+        # Per-submission checkpoints of per-image scores, so an interrupted
+        # evaluation resumes from the last completed chunk (see checkpoint.py)
+        self.checkpoint_dir = os.environ.get("EVAL_CHECKPOINT_DIR")
+        self.checkpoint_chunk = int(os.environ.get("EVAL_CHECKPOINT_CHUNK", "1000"))
+        self.checkpoint = None
+        self.rouge_scorer = Rouge1Scorer(
+            workers=int(os.environ.get("ROUGE_WORKERS", "1"))
+        )
+        # Models are loaded on first use; with EVAL_MODEL_MEMORY_MB set, the
+        # least recently used ones are unloaded to keep them within budget.
+        self.models = ModelRegistry(
+            budget_mb=int(os.environ.get("EVAL_MODEL_MEMORY_MB", "0"))
         )
-        self.bert_scorer = None
-        self.bleurt_model = None
-        self.bleurt_tokenizer = None
-        self.bleurt_config = None
-        self.image_similarity_scorer = None
+        for metric, loader in (
+            ("bert", self._load_bert_scorer),
+            ("align", self._load_align_scorer),
+            ("similarity", self._load_image_similarity_scorer),
+            ("bleurt", self._load_bleurt),
+            ("medcat", self._load_medcat_scorer),
+        ):
+            self.models.register(metric, loader, METRIC_MEMORY_MB[metric])
+        self.embeddings_dir = kwargs.get("embeddings_dir") or PRECOMPUTED_DIR
         self._image_embeddings = None
+        self._gt_sha256 = None
 
-    def _evaluate(self, client_payload, _context={}):
+    def _evaluate(self, client_payload, _context={}, metrics=None):
         print("Evaluating...")
         submission_file_path = client_payload["submission_file_path"]
-        predictions = self.load_predictions(submission_file_path)
-
-        print("Compute BERTScore")
-        bertscore = self.compute_bertscore(predictions)
-        print("BERTScore:", bertscore)
-        print("Compute AlignScore")
-        alignscore = self.compute_alignscore(predictions)
-        print("AlignScore:", alignscore)
-        print("Compute ROUGE")
-        rouge = self.compute_rouge(predictions)
-        print("ROUGE:", rouge)
-        print("Compute Image-Caption Similarity")
-        sim = self.compute_similarity(predictions)
-        print("Similarity:", sim)
-        print("Compute BLEURT")
-        bleurt = self.compute_bleurt(predictions)
-        print("BLEURT:", bleurt)
-        print("Compute MedCAT")
-        medcats = self.compute_medcats(predictions)
-        print("Medcats:", medcats)
-
-        relevance = np.mean([bertscore, rouge, sim, bleurt])
-        factuality = np.mean([medcats, alignscore])
+        metrics = self._select_metrics(metrics)
+        with self._submission_run(submission_file_path) as predictions:
+            if self.concurrent:
+                scores = self._metric_scheduler().run(predictions, metrics)
+            else:
+                scores = {}
+                for metric in metrics:
+                    label = self.METRICS[metric][0]
+                    print(f"Compute {label}")
+                    scores[metric] = self._compute_metric(metric, predictions)
+                    print(f"{label}:", scores[metric])
+        return self._build_result(scores)
+
+    @contextlib.contextmanager
+    def _submission_run(self, submission_file_path):
+        """Load one submission and yield its predictions with the profiler
+        reset and its checkpoint active. After the block succeeds the
+        checkpoint is removed and the profile is finished."""
+        self.profiler.reset(keep=("load_gt",))
+        with self.profiler.stage("load_predictions") as record:
+            predictions = self.load_predictions(submission_file_path)
+            record["items"] = len(predictions)
+        self.checkpoint = self._checkpoint_for(submission_file_path)
+        try:
+            yield predictions
+        finally:
+            checkpoint, self.checkpoint = self.checkpoint, None
+        if checkpoint is not None:
+            checkpoint.remove()
+        if self.score_cache is not None:
+            self.score_cache.print_stats()
+        self._finish_profile()
+
+    def evaluate_many(self, submission_file_paths, metrics=None):
+        """Evaluate several submissions metric by metric.
+
+        Each metric model is loaded once, used for every submission and
+        released before the next metric, so only one is resident at a time.
+        Returns one result object per submission path.
+        """
+        metrics = self._select_metrics(metrics)
+        self.profiler.reset(keep=("load_gt",))
+        with self.profiler.stage("load_predictions") as record:
+            predictions = {
+                path: self.load_predictions(path) for path in submission_file_paths
+            }
+            record["items"] = sum(len(pairs) for pairs in predictions.values())
+        scores = {path: {} for path in submission_file_paths}
+        checkpoints = {path: self._checkpoint_for(path) for path in predictions}
+        keep_models = self.keep_models
+        self.keep_models = True
+        try:
+            for metric in metrics:
+                label, method, _ = self.METRICS[metric]
+                print(f"Compute {label} for {len(predictions)} submissions")
+                with self.profiler.stage(metric) as record:
+                    for path, candidate_pairs in predictions.items():
+                        self.checkpoint = checkpoints[path]
+                        scores[path][metric] = getattr(self, method)(candidate_pairs)
+                        print(f"{label} ({path}):", scores[path][metric])
+                        record["items"] += len(candidate_pairs)
+                self._release_models(metric)
+        finally:
+            self.keep_models = keep_models
+            self.checkpoint = None
+        for checkpoint in checkpoints.values():
+            if checkpoint is not None:
+                checkpoint.remove()
+        if self.score_cache is not None:
+            self.score_cache.print_stats()
+        self._finish_profile()
+        return {path: self._build_result(scores[path]) for path in predictions}
+
+    @classmethod
+    def _build_result(cls, scores):
+        # Metrics that were not run are None; relevance and factuality are
+        # then the means of the metrics that were, and the result is marked
+        # partial since they are not comparable with full runs.
+        bertscore = scores.get("bert")
+        rouge = scores.get("rouge")
+        sim = scores.get("similarity")
+        bleurt = scores.get("bleurt")
+        medcats = scores.get("medcat")
+        alignscore = scores.get("align")
+
+        relevance = cls._mean_of(scores, cls.RELEVANCE_METRICS)
+        factuality = cls._mean_of(scores, cls.FACTUALITY_METRICS)
 
         _result_object = {
             "score": relevance,
@@ -119,15 +300,100 @@ class CaptionEvaluator:
             )
         )
 
+        if any(metric not in scores for metric in cls.METRICS):
+            _result_object["partial"] = True
+            _result_object["metrics"] = [m for m in cls.METRICS if m in scores]
+            print(
+                "Partial evaluation ({}): Relevance and Factuality only average "
+                "the computed metrics.".format(", ".join(_result_object["metrics"]))
+            )
+
         assert "score" in _result_object
         assert "score_secondary" in _result_object
 
         return _result_object
 
+    def _scored_pairs(self, candidate_pairs):
+        """Keys of ``candidate_pairs`` and the indices of the pairs a model
+        has to score. A pair whose reference and candidate captions are both
+        empty scores 1 without the model."""
+        keys = list(candidate_pairs)
+        scored = [
+            idx
+            for idx, image_key in enumerate(keys)
+            if len(self.gt[image_key]) != 0 or len(candidate_pairs[image_key]) != 0
+        ]
+        return keys, scored
+
+    @staticmethod
+    def _mean_of(scores, metrics):
+        values = [scores[metric] for metric in metrics if metric in scores]
+        return np.mean(values) if values else None
+
+    def _select_metrics(self, metrics=None):
+        """Validated metric keys in METRICS order; ``metrics`` may be a list or
+        a comma-separated string and defaults to the evaluator's selection."""
+        if metrics is None:
+            return list(self.metrics)
+        if isinstance(metrics, str):
+            metrics = [m.strip().lower() for m in metrics.split(",") if m.strip()]
+        if "all" in metrics:
+            return list(self.METRICS)
+        unknown = [m for m in metrics if m not in self.METRICS]
+        if unknown or not metrics:
+            raise Exception(
+                "Unknown metrics: {}. Choose from: {}.".format(
+                    ", ".join(unknown) or "(none)", ", ".join(self.METRICS)
+                )
+            )
+        return [m for m in self.METRICS if m in metrics]
+
+    def _compute_metric(self, metric, candidate_pairs):
+        with self.profiler.stage(metric, items=len(candidate_pairs)):
+            return getattr(self, self.METRICS[metric][1])(candidate_pairs)
+
+    def _finish_profile(self):
+        self.last_profile = self.profiler.report(self.models)
+        print_profile(self.last_profile)
+
+    def _checkpoint_for(self, submission_file_path):
+        if not self.checkpoint_dir:
+            return None
+        return Checkpoint.for_submission(
+            self.checkpoint_dir, submission_file_path, self.ground_truth_path
+        )
+
+    def close(self):
+        """Shut down the worker processes of concurrent runs and release
+        every loaded model."""
+        if self._scheduler is not None:
+            self._scheduler.close()
+            self._scheduler = None
+        self.models.release_all()
+        if self.device == "cuda":
+            self._free_cuda()
+
+    def _metric_scheduler(self):
+        if self._scheduler is None:
+            self._scheduler = MetricScheduler(
+                self,
+                cpu_budget=int(os.environ.get("EVAL_CPUS", "0")) or None,
+                memory_budget_mb=int(os.environ.get("EVAL_MEMORY_BUDGET_MB", "0")),
+            )
+        return self._scheduler
+
+    def _release_models(self, metric):
+        self.models.release(metric)
+        self._free_cuda()
+
     def load_gt(self):
         print("Loading ground truth...")
+        return self.read_ground_truth(self.ground_truth_path)
+
+    @staticmethod
+    def read_ground_truth(ground_truth_path):
         pairs = {}
-        with open(self.ground_truth_path) as csvfile:
+        with open(ground_truth_path) as csvfile:
             reader = csv.reader(csvfile)
             first_line = next(reader)
             # Check if it's a header
@@ -195,132 +461,350 @@ class CaptionEvaluator:
         caption = caption.translate(translator)
         return caption
 
+    def _cached_scores(self, metric, candidate_pairs, score_fn):
+        """Per-image scores of ``metric`` in ``candidate_pairs`` order.
+
+        While a checkpoint is active, images scored by an interrupted run are
+        skipped and the rest are scored and saved chunk by chunk. With a
+        score cache configured, only captions without a cached score for this
+        metric and model are passed to ``score_fn``.
+        """
+        # Metric and model names coincide; a model that is scoring is not
+        # unloaded to make room for another metric's model
+        with self.models.using(metric):
+            if self.checkpoint is not None:
+                return self.checkpoint.scores(
+                    metric,
+                    self._cache_model_id(metric),
+                    candidate_pairs,
+                    lambda pairs: self._score_cache_scores(metric, pairs, score_fn),
+                    chunk_size=self.checkpoint_chunk,
+                )
+            return self._score_cache_scores(metric, candidate_pairs, score_fn)
+
+    def _score_cache_scores(self, metric, candidate_pairs, score_fn):
+        if self.score_cache is None:
+            return [float(score) for score in score_fn(candidate_pairs)]
+        # Metrics that score preprocessed captions share a cache entry for
+        # captions that preprocess identically.
+        if metric in ("bert", "rouge", "bleurt"):
+            normalize = self.preprocess_caption
+        else:
+            normalize = str
+        model_id = self._cache_model_id(metric)
+        entries = [
+            (image_key, self._cache_entry_hash(metric, image_key, caption, normalize))
+            for image_key, caption in candidate_pairs.items()
+        ]
+        scores = self.score_cache.get_many(metric, model_id, entries)
+        misses = [entry for entry in entries if entry not in scores]
+        if misses:
+            miss_scores = score_fn(
+                {image_key: candidate_pairs[image_key] for image_key, _ in misses}
+            )
+            rows = [
+                (image_key, caption_hash, float(score))
+                for (image_key, caption_hash), score in zip(misses, miss_scores)
+            ]
+            self.score_cache.put_many(metric, model_id, rows)
+            scores.update(
+                ((image_key, caption_hash), score)
+                for image_key, caption_hash, score in rows
+            )
+        print(
+            f"Score cache {metric}: {len(entries) - len(misses)} hits, "
+            f"{len(misses)} misses"
+        )
+        return [scores[entry] for entry in entries]
+
+    def _cache_entry_hash(self, metric, image_key, caption, normalize):
+        # Covers the reference side as well, so a corrected captions.csv or a
+        # re-encoded image never serves a score computed against the old one
+        if metric == "similarity":
+            reference = self._image_embedding_hash(image_key)
+        else:
+            reference = normalize(self.gt.get(image_key, ""))
+        parts = [normalize(caption), reference]
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def _image_embedding_hash(self, image_key):
+        self._ensure_image_embeddings()
+        store = self._image_embeddings
+        if image_key not in store:
+            return ""
+        # Stores written before image hashes were recorded fall back to the
+        # embedding itself
+        return (
+            store.hashes.get(image_key)
+            or hashlib.sha256(np.asarray(store[image_key]).tobytes()).hexdigest()
+        )
+
+    def _ground_truth_sha256(self):
+        if self._gt_sha256 is None:
+            self._gt_sha256 = file_sha256(self.ground_truth_path)
+        return self._gt_sha256
+
+    def metric_scores(self, metric, candidate_pairs):
+        """Per-image scores of one metric, in ``candidate_pairs`` order."""
+        return self._cached_scores(
+            metric, candidate_pairs, getattr(self, self.METRICS[metric][2])
+        )
+
+    def _cache_model_id(self, metric):
+        model_id = self.MODEL_IDS[metric]
+        if metric == "medcat":
+            model_id += ":" + os.path.basename(default_model_path())
+        if metric == "bert":
+            # IDF weights are computed from the whole ground-truth corpus
+            model_id += ":" + self._ground_truth_sha256()[:16]
+        if metric in self.TORCH_METRICS and self.precision != "fp32":
+            model_id += ":" + self.precision
+        return model_id
+
     def compute_bertscore(self, candidate_pairs):
         print("Computing BERTScore")
-        if self.bert_scorer is None:
-            idf_sentences = [
-                self.preprocess_caption(caption) for caption in self.gt.values()
+        bert_scores = self._cached_scores(
+            "bert", candidate_pairs, self._bertscore_scores
+        )
+        return np.mean(bert_scores)
+
+    def _bertscore_scores(self, candidate_pairs):
+        bert_scorer = self.models.get("bert")
+        with self._precision_context():
+            if self.bertscore_batched:
+                bert_scores = self._bertscore_batched(bert_scorer, candidate_pairs)
+            else:
+                keys, scored = self._scored_pairs(candidate_pairs)
+                bert_scores = [1] * len(keys)
+                for idx in scored:
+                    bert_scores[idx] = bert_scorer.score(
+                        cands=[self.preprocess_caption(candidate_pairs[keys[idx]])],
+                        refs=[self.preprocess_caption(self.gt[keys[idx]])],
+                    )[2].item()
+        if self.device == "cuda" and not self.keep_models:
+            self._release_models("bert")
+        return bert_scores
+
+    def _load_bert_scorer(self):
+        from bert_score import BERTScorer
+
+        idf_sentences = [
+            self.preprocess_caption(caption) for caption in self.gt.values()
+        ]
+        bert_scorer = BERTScorer(
+            model_type="microsoft/deberta-xlarge-mnli",
+            idf=True,
+            idf_sents=idf_sentences,
+            device=self.device,
+        )
+        self._apply_precision(bert_scorer._model)
+        return bert_scorer
+
+    def _bertscore_batched(self, bert_scorer, candidate_pairs):
+        # Scores the non-empty pairs in score() calls of at most
+        # BERTSCORE_CALL_PAIRS pairs, grouped by length. Scores are expected
+        # to differ from the per-pair path (BERTSCORE_BATCHED=0) only by
+        # padding and float summation order; this has not been measured.
+        keys, scored = self._scored_pairs(candidate_pairs)
+        bert_scores = [1.0] * len(keys)
+        if not scored:
+            return bert_scores
+        pairs, inverse = _dedup(
+            [
+                (
+                    self.preprocess_caption(self.gt[keys[idx]]),
+                    self.preprocess_caption(candidate_pairs[keys[idx]]),
+                )
+                for idx in scored
+            ],
+            "BERTScore",
+        )
+        refs = [ref for ref, _ in pairs]
+        cands = [cand for _, cand in pairs]
+        pair_scores = [0.0] * len(pairs)
+        batch_size = max(1, self.text_batch_size)
+        if self.text_batch_max_tokens > 0:
+            tokenizer = bert_scorer._tokenizer
+            lengths = [
+                max(len(tokenizer.tokenize(c)), len(tokenizer.tokenize(r))) + 2
+                for c, r in zip(cands, refs)
             ]
-            self.bert_scorer = BERTScorer(
-                model_type="microsoft/deberta-xlarge-mnli",
-                idf=True,
-                idf_sents=idf_sentences,
-                device=self.device,
+            batches = _length_batches(
+                lengths, batch_size, max_tokens=self.text_batch_max_tokens
             )
-        bert_scores = [
-            (
-                self.bert_scorer.score(
-                    cands=[self.preprocess_caption(candidate_pairs[image_key])],
-                    refs=[self.preprocess_caption(self.gt[image_key])],
-                )[2].item()
-                if len(self.gt[image_key]) != 0 or len(candidate_pairs[image_key]) != 0
-                else 1
+        else:
+            batches = _length_batches(
+                [len(c.split()) + len(r.split()) for c, r in zip(cands, refs)],
+                max(1, self.bertscore_call_pairs),
             )
-            for image_key in candidate_pairs
-        ]
-        if self.device == "cuda":
-            self.bert_scorer = None
-            self._free_cuda()
-        return np.mean(bert_scores)
+        for batch in tqdm(batches, desc="BERTScore batches", unit="batch"):
+            f1 = bert_scorer.score(
+                cands=[cands[i] for i in batch],
+                refs=[refs[i] for i in batch],
+                batch_size=len(batch) if self.text_batch_max_tokens > 0 else batch_size,
+            )[2]
+            for i, value in zip(batch, f1.tolist()):
+                pair_scores[i] = value
+        for idx, unique_idx in zip(scored, inverse):
+            bert_scores[idx] = pair_scores[unique_idx]
+        return bert_scores
 
     def compute_rouge(self, candidate_pairs):
         print("Computing ROUGE")
-        rouge_scores = [
-            (
-                self.scorers["rouge"][0].compute(
-                    predictions=[self.preprocess_caption(candidate_pairs[image_key])],
-                    references=[self.preprocess_caption(self.gt[image_key])],
-                    use_aggregator=False,
-                    use_stemmer=False,
-                )["rouge1"]
-                if len(self.gt[image_key]) != 0 or len(candidate_pairs[image_key]) != 0
-                else 1
-            )
-            for image_key in candidate_pairs
-        ]
+        rouge_scores = self._cached_scores("rouge", candidate_pairs, self._rouge_scores)
         return np.mean(rouge_scores)
 
+    def _rouge_scores(self, candidate_pairs):
+        keys, scored = self._scored_pairs(candidate_pairs)
+        rouge_scores = [1.0] * len(keys)
+        pair_scores = self.rouge_scorer.score(
+            references=[self.preprocess_caption(self.gt[keys[i]]) for i in scored],
+            predictions=[
+                self.preprocess_caption(candidate_pairs[keys[i]]) for i in scored
+            ],
+        )
+        for idx, score in zip(scored, pair_scores):
+            rouge_scores[idx] = score
+        return rouge_scores
+
     def compute_alignscore(self, candidate_pairs):
         print("Computing Alignscore")
-        self.align_scorer = AlignScore(
+        align_scores = self._cached_scores(
+            "align", candidate_pairs, self._alignscore_scores
+        )
+        return np.mean(align_scores)
+
+    def _alignscore_scores(self, candidate_pairs):
+        align_scorer = self.models.get("align")
+        keys, scored = self._scored_pairs(candidate_pairs)
+        align_scores = [1] * len(keys)
+        if scored:
+            pairs, inverse = _dedup(
+                [(self.gt[keys[idx]], candidate_pairs[keys[idx]]) for idx in scored],
+                "AlignScore",
+            )
+            with self._precision_context():
+                pair_scores = align_scorer.score(
+                    contexts=[context for context, _ in pairs],
+                    claims=[claim for _, claim in pairs],
+                )
+            for idx, unique_idx in zip(scored, inverse):
+                align_scores[idx] = pair_scores[unique_idx]
+        if self.device == "cuda":
+            self._free_cuda()
+        return align_scores
+
+    def _load_align_scorer(self):
+        from alignscore import AlignScore
+
+        print("Loading AlignScore")
+        align_scorer = AlignScore(
             model="roberta-large",
             batch_size=32,
             device=self.device,
             ckpt_path=os.path.join(
-                CURRENT_DIR
-            , "models/AlignScore/AlignScore-base.ckpt"
+                CURRENT_DIR, "models/AlignScore/AlignScore-base.ckpt"
             ),
             evaluation_mode="nli_sp",
             verbose=False,
         )
-        align_scores = [
-            (
-                self.align_scorer.score(
-                    contexts=[self.gt[image_key]], claims=[candidate_pairs[image_key]]
-                )[0]
-                if len(self.gt[image_key]) != 0 or len(candidate_pairs[image_key]) != 0
-                else 1
-            )
-            for image_key in candidate_pairs
-        ]
-        if self.device == "cuda":
-            self.align_scorer = None
-            self._free_cuda()
-        return np.mean(align_scores)
+        self._apply_precision(align_scorer.model.model)
+        return align_scorer
 
     def compute_medcats(self, candidate_pairs):
         print("Computing MEDCATS")
-        medcat_scores = []
-        for image_key in candidate_pairs:
-            if len(self.gt[image_key]) != 0 or len(candidate_pairs[image_key]) != 0:
-                score = self.medcat_scorer.score(
-                    self.gt[image_key], candidate_pairs[image_key]
-                )
-            else:
-                score = 1
-            medcat_scores.append(score)
+        medcat_scores = self._cached_scores(
+            "medcat", candidate_pairs, self._medcat_scores
+        )
         return np.mean(medcat_scores)
 
+    def _medcat_scores(self, candidate_pairs):
+        medcat_scorer, medcat_gt_cuis = self.models.get("medcat")
+        keys, scored = self._scored_pairs(candidate_pairs)
+        medcat_scores = [1] * len(keys)
+        reference_cuis = None
+        if medcat_gt_cuis is not None and all(
+            keys[idx] in medcat_gt_cuis for idx in scored
+        ):
+            reference_cuis = [medcat_gt_cuis[keys[idx]] for idx in scored]
+        pair_scores = medcat_scorer.score_batch(
+            [self.gt[keys[idx]] for idx in scored],
+            [candidate_pairs[keys[idx]] for idx in scored],
+            reference_cuis=reference_cuis,
+        )
+        for idx, score in zip(scored, pair_scores):
+            medcat_scores[idx] = score
+        return medcat_scores
+
+    def _load_medcat_scorer(self):
+        print("Loading MedCatScorer")
+        medcat_model_path = default_model_path()
+        medcat_scorer = MedCatScorer(
+            model_path=medcat_model_path,
+            n_process=int(os.environ.get("MEDCAT_WORKERS", "0")) or None,
+            batch_size=int(os.environ.get("MEDCAT_BATCH_SIZE", "0")) or None,
+        )
+        medcat_gt_cuis = load_gt_cuis(
+            gt_cache_path(medcat_model_path, self.ground_truth_path)
+        )
+        if medcat_gt_cuis is not None:
+            print(f"Loaded cached MedCAT concepts for {len(medcat_gt_cuis)} captions")
+        return medcat_scorer, medcat_gt_cuis
+
     def _ensure_image_embeddings(self):
         if self._image_embeddings is not None:
             return
-        cache_path = os.path.join(
-            CURRENT_DIR
-        , "precomputed", f"image_embeddings_{self.dataset_type}.npz"
-        )
-        if not os.path.exists(cache_path):
+        with self.profiler.stage("load_embeddings") as record:
+            store = load_embedding_store(self.dataset_type, self.embeddings_dir)
+            record["items"] = len(store) if store is not None else 0
+        if store is None:
             raise Exception(
-                f"Precomputed image embeddings not found at {cache_path}."
+                "Precomputed image embeddings not found at {}.".format(
+                    store_paths(self.dataset_type, self.embeddings_dir)[1]
+                )
             )
-        data = np.load(cache_path)
-        self._image_embeddings = {k: data[k] for k in data.files}
+        self._image_embeddings = store
 
     def _encode_texts(self, texts):
-        scorer = self.image_similarity_scorer
-        batch_size = max(1, self.text_batch_size)
+        unique_texts, inverse = _dedup(list(texts), "Caption encoding")
+        return self._encode_unique_texts(unique_texts)[inverse]
+
+    def _encode_unique_texts(self, texts):
+        import torch
+
+        scorer = self.models.get("similarity")
+        # Word counts stand in for encoder token counts when bucketing
+        batches = self._text_batches([len(text.split()) + 2 for text in texts])
         encoded_chunks = []
-        for start in tqdm(
-            range(0, len(texts), batch_size), desc="Encode captions", unit="batch"
-        ):
-            batch = texts[start : start + batch_size]
-            with torch.inference_mode():
+        for batch_indices in tqdm(batches, desc="Encode captions", unit="batch"):
+            batch = [texts[i] for i in batch_indices]
+            with torch.inference_mode(), self._precision_context():
                 outputs = scorer.encode(texts=batch)
             if isinstance(outputs, dict) and "text_embeddings" in outputs:
                 embeddings = outputs["text_embeddings"]
             else:
                 embeddings = outputs
             if hasattr(embeddings, "detach"):
-                embeddings = embeddings.detach()
+                embeddings = embeddings.detach().float()
             if hasattr(embeddings, "cpu"):
                 embeddings = embeddings.cpu().numpy()
             encoded_chunks.append(np.array(embeddings))
             if self.device == "cuda":
                 self._free_cuda()
-        return np.concatenate(encoded_chunks, axis=0)
+        encoded = np.concatenate(encoded_chunks, axis=0)
+        order = [i for batch_indices in batches for i in batch_indices]
+        restored = np.empty_like(encoded)
+        restored[order] = encoded
+        return restored
 
     def compute_similarity(self, candidate_pairs):
         print("Computing MedImageInsights Similarity")
-        self._load_image_similarity_scorer()
+        sim_scores = self._cached_scores(
+            "similarity", candidate_pairs, self._similarity_scores
+        )
+        return np.mean(sim_scores)
+
+    def _similarity_scores(self, candidate_pairs):
         self._ensure_image_embeddings()
 
         missing = [
@@ -336,37 +820,42 @@ class CaptionEvaluator:
         captions = list(candidate_pairs.values())
         text_embeddings = self._encode_texts(captions)
 
-        sim_scores = []
-        for idx, image_key in enumerate(candidate_pairs):
-            candidate_caption = candidate_pairs[image_key]
-            try:
-                if len(candidate_caption) == 0:
-                    print("Candidate caption is empty")
-                    score = 0
-                else:
-                    with torch.no_grad():
-                        v = self._image_embeddings[image_key]
-                        c = text_embeddings[idx]
-                        w = 2.5
-                        cos = np.dot(c, v) / (np.linalg.norm(c) * np.linalg.norm(v))
-                        score = w * np.max([cos, 0])
-            except Exception as e:
-                print(e)
-                score = 1
-            sim_scores.append(score)
-        if self.device == "cuda":
-            self.image_similarity_scorer = None
-            self._free_cuda()
-        return np.mean(sim_scores)
+        keys = list(candidate_pairs)
+        w = 2.5
+        try:
+            image_embeddings = self._image_embeddings.rows(keys)
+            cos = np.einsum("ij,ij->i", text_embeddings, image_embeddings) / (
+                np.linalg.norm(text_embeddings, axis=1)
+                * np.linalg.norm(image_embeddings, axis=1)
+            )
+            sim_scores = w * np.maximum(cos, 0).astype(np.float64)
+        except Exception as e:
+            print(e)
+            sim_scores = np.ones(len(keys))
+        empty = np.array([len(candidate_pairs[k]) == 0 for k in keys], dtype=bool)
+        if empty.any():
+            print(f"Candidate caption is empty for {int(empty.sum())} images")
+            sim_scores[empty] = 0
+        if self.device == "cuda" and not self.keep_models:
+            self._release_models("similarity")
+        return sim_scores
 
     def _load_image_similarity_scorer(self):
-        if self.image_similarity_scorer is not None:
-            return
+        # check if the directory exist
+        if not os.path.exists(med_image_insights_dir):
+            raise Exception(
+                "MedImageInsights directory not found at {}".format(
+                    med_image_insights_dir
+                )
+            )
+        if med_image_insights_dir not in sys.path:
+            sys.path.insert(0, med_image_insights_dir)
+        from medimageinsightmodel import MedImageInsight
+
         device = self.device
         print("Loading MedImageInsight")
         scorer = MedImageInsight(
-            model_dir=os.path.join(CURRENT_DIR
-        , "MedImageInsights/2024.09.27"),
+            model_dir=os.path.join(CURRENT_DIR, "MedImageInsights/2024.09.27"),
             vision_model_name="medimageinsigt-v1.0.0.pt",
             language_model_name="language_model.pth",
         )
@@ -378,39 +867,54 @@ class CaptionEvaluator:
                 scorer.to(device)
             except Exception:
                 pass
+        if hasattr(scorer, "model"):
+            self._apply_precision(scorer.model)
         print(f"MedImageInsight device: {device}")
-        self.image_similarity_scorer = scorer
+        return scorer
 
     def compute_bleurt(self, candidate_pairs):
         print("Computing BLEURT")
-        if self.bleurt_model is None or self.bleurt_tokenizer is None:
-            self.bleurt_config = BleurtConfig.from_pretrained(
-                "lucadiliello/BLEURT-20-D12"
-            )
-            self.bleurt_model = BleurtForSequenceClassification.from_pretrained(
-                "lucadiliello/BLEURT-20-D12"
-            )
-            self.bleurt_tokenizer = BleurtTokenizer.from_pretrained(
-                "lucadiliello/BLEURT-20-D12"
-            )
-            self.bleurt_model.to(self.device)
-        references = [
-            self.preprocess_caption(self.gt[image_key]) for image_key in candidate_pairs
-        ]
-        candidates = [
-            self.preprocess_caption(candidate_pairs[image_key])
-            for image_key in candidate_pairs
-        ]
-        self.bleurt_model.eval()
-        scores = []
-        bs = max(1, self.text_batch_size)
-        for start in tqdm(
-            range(0, len(references), bs), desc="BLEURT batches", unit="batch"
+        bleurt_scores = self._cached_scores(
+            "bleurt", candidate_pairs, self._bleurt_scores
+        )
+        return np.mean(bleurt_scores)
+
+    def _bleurt_scores(self, candidate_pairs):
+        import torch
+
+        bleurt_model, bleurt_tokenizer = self.models.get("bleurt")
+        pairs, inverse = _dedup(
+            [
+                (
+                    self.preprocess_caption(self.gt[image_key]),
+                    self.preprocess_caption(candidate_pairs[image_key]),
+                )
+                for image_key in candidate_pairs
+            ],
+            "BLEURT",
+        )
+        references = [reference for reference, _ in pairs]
+        candidates = [candidate for _, candidate in pairs]
+        bleurt_model.eval()
+        if self.text_batch_by_length or self.text_batch_max_tokens > 0:
+            lengths = [
+                len(
+                    bleurt_tokenizer(
+                        reference, candidate, truncation=True, max_length=512
+                    )["input_ids"]
+                )
+                for reference, candidate in zip(references, candidates)
+            ]
+        else:
+            lengths = [0] * len(references)
+        scores = [0.0] * len(references)
+        for batch_indices in tqdm(
+            self._text_batches(lengths), desc="BLEURT batches", unit="batch"
         ):
-            refs = references[start : start + bs]
-            cands = candidates[start : start + bs]
-            with torch.inference_mode():
-                inputs = self.bleurt_tokenizer(
+            refs = [references[i] for i in batch_indices]
+            cands = [candidates[i] for i in batch_indices]
+            with torch.inference_mode(), self._precision_context():
+                inputs = bleurt_tokenizer(
                     refs,
                     cands,
                     padding="longest",
@@ -420,19 +924,75 @@ class CaptionEvaluator:
                 )
                 inputs = {k: v.to(self.device) for k, v in inputs.items()}
                 batch_scores = (
-                    self.bleurt_model(**inputs).logits.flatten().cpu().tolist()
+                    bleurt_model(**inputs).logits.flatten().float().cpu().tolist()
                 )
-            scores.extend(batch_scores)
+            for i, score in zip(batch_indices, batch_scores):
+                scores[i] = score
             if torch.cuda.is_available():
                 torch.cuda.empty_cache()
-        if torch.cuda.is_available() and self.device == "cuda":
-            self.bleurt_model = None
-            self.bleurt_tokenizer = None
-            self.bleurt_config = None
-            self._free_cuda()
-        return np.mean(scores)
+        if self.device == "cuda" and not self.keep_models:
+            self._release_models("bleurt")
+        return [scores[unique_idx] for unique_idx in inverse]
+
+    def _load_bleurt(self):
+        from bleurt_pytorch import BleurtForSequenceClassification, BleurtTokenizer
+
+        # BLEURT-20-D12's config is loaded along with the model weights
+        bleurt_model = BleurtForSequenceClassification.from_pretrained(
+            "lucadiliello/BLEURT-20-D12"
+        )
+        bleurt_tokenizer = BleurtTokenizer.from_pretrained("lucadiliello/BLEURT-20-D12")
+        bleurt_model.to(self.device)
+        self._apply_precision(bleurt_model)
+        return bleurt_model, bleurt_tokenizer
+
+    def _resolve_precision(self, precision):
+        precision = precision.lower()
+        if precision not in ("fp32", "int8", "bf16"):
+            raise Exception(
+                f"Unknown EVAL_PRECISION '{precision}'. Expected fp32, int8 or bf16."
+            )
+        if precision == "int8" and self.device != "cpu":
+            print("int8 dynamic quantization is CPU-only; using fp32.")
+            return "fp32"
+        if precision == "bf16" and self.device == "cpu" and not _cpu_supports_bf16():
+            print("This CPU has no native bf16 support; using fp32.")
+            return "fp32"
+        print(f"Model precision: {precision}")
+        return precision
+
+    def _apply_precision(self, model):
+        # bf16 is applied per call by _precision_context; int8 replaces the
+        # Linear layers in place with dynamically quantized ones.
+        if self.precision == "int8":
+            import torch
+
+            torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+        return model
+
+    def _precision_context(self):
+        if self.precision == "bf16":
+            import torch
+
+            return torch.autocast(device_type=self.device, dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    def _text_batches(self, lengths):
+        """Index batches for texts with the given token lengths, in file order
+        unless length bucketing or a token budget is configured."""
+        batch_size = max(1, self.text_batch_size)
+        if self.text_batch_by_length or self.text_batch_max_tokens > 0:
+            return _length_batches(lengths, batch_size, self.text_batch_max_tokens)
+        return [
+            list(range(start, min(start + batch_size, len(lengths))))
+            for start in range(0, len(lengths), batch_size)
+        ]
 
     def _free_cuda(self):
+        import torch
+
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
 
@@ -449,8 +1009,7 @@ if __name__ == "__main__":
             sys.exit(1)
 
     print(f"Running evaluator for {dataset_type} dataset...")
-    ground_truth_path = os.path.join(CURRENT_DIR
-, f"data/{dataset_type}/captions.csv")
+    ground_truth_path = os.path.join(CURRENT_DIR, f"data/{dataset_type}/captions.csv")
     submission_file_path = f"/app/data/{dataset_type}/submission.csv"
 
     if not os.path.exists(ground_truth_path):
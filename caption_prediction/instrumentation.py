@@ -0,0 +1,113 @@
+import json
+import time
+import resource
+import threading
+import contextlib
+from model_registry import rss_mb
+
+
+class Profiler:
+    """Wall time, CPU time, throughput and peak RSS growth per evaluation stage.
+
+    A background thread samples RSS every ``interval`` seconds while a stage
+    is open, so ``peak_rss_delta_mb`` also catches memory that is freed again
+    before the stage ends; the thread exits when no stage is open. CPU time
+    is process-wide: stages running
+    concurrently in threads share it, and work done in worker processes is
+    not included.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.stages = {}
+        self.lock = threading.Lock()
+        self._open = {}
+        self._sampler = None
+
+    @contextlib.contextmanager
+    def stage(self, name, items=0):
+        record = {"items": items}
+        start_rss = rss_mb()
+        with self.lock:
+            self._open[id(record)] = [start_rss, start_rss]
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, daemon=True)
+                self._sampler.start()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            with self.lock:
+                start_rss, peak_rss = self._open.pop(id(record))
+            peak_rss = max(peak_rss, rss_mb())
+            record.update(
+                wall_seconds=round(wall, 4),
+                cpu_seconds=round(cpu, 4),
+                items_per_second=round(record["items"] / wall, 2) if wall else None,
+                peak_rss_delta_mb=round(peak_rss - start_rss, 1),
+            )
+            self.add(name, record)
+
+    def add(self, name, record):
+        with self.lock:
+            self.stages[name] = record
+
+    def reset(self, keep=()):
+        with self.lock:
+            self.stages = {k: v for k, v in self.stages.items() if k in keep}
+
+    def report(self, models=None):
+        """Stage records plus, given a ModelRegistry, its model load times."""
+        with self.lock:
+            report = {"stages": {name: dict(r) for name, r in self.stages.items()}}
+        if models is not None:
+            report["models"] = {
+                name: {
+                    "load_seconds": round(models.load_seconds[name], 4),
+                    "rss_delta_mb": round(models.sizes_mb[name], 1),
+                }
+                for name in models.load_seconds
+            }
+        # Peak RSS of the process so far (ru_maxrss is in KB on Linux)
+        report["peak_rss_mb"] = round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        )
+        return report
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            current = rss_mb()
+            with self.lock:
+                if not self._open:
+                    self._sampler = None
+                    return
+                for usage in self._open.values():
+                    usage[1] = max(usage[1], current)
+
+
+def print_profile(profile):
+    print("Stage,Wall s,CPU s,Items/s,Peak RSS delta MB")
+    for name, record in profile["stages"].items():
+        print(
+            "{},{},{},{},{}".format(
+                name,
+                record["wall_seconds"],
+                record["cpu_seconds"],
+                record["items_per_second"],
+                record["peak_rss_delta_mb"],
+            )
+        )
+    for name, record in profile.get("models", {}).items():
+        print(
+            f"Model {name}: loaded in {record['load_seconds']}s, "
+            f"+{record['rss_delta_mb']} MB RSS"
+        )
+
+
+def write_profile(profile, path):
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=2)
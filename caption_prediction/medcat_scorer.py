@@ -1,154 +1,226 @@
-from medcat.cat import CAT
+import os
+import csv
+import json
+import hashlib
+from file_hash import file_sha256
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MEDCON_TYPE_IDS = {
+    "T048",
+    "T197",
+    "T088",
+    "T055",
+    "T029",
+    "T004",
+    "T043",
+    "T101",
+    "T129",
+    "T069",
+    "T045",
+    "T079",
+    "T167",
+    "T049",
+    "T010",
+    "T080",
+    "T121",
+    "T082",
+    "T066",
+    "T040",
+    "T170",
+    "T086",
+    "T058",
+    "T130",
+    "T195",
+    "T109",
+    "T127",
+    "T037",
+    "T125",
+    "T081",
+    "T071",
+    "T061",
+    "T126",
+    "T192",
+    "T077",
+    "T073",
+    "T168",
+    "T185",
+    "T089",
+    "T074",
+    "T001",
+    "T059",
+    "T104",
+    "T083",
+    "T051",
+    "T044",
+    "T002",
+    "T194",
+    "T028",
+    "T094",
+    "T057",
+    "T053",
+    "T090",
+    "T060",
+    "T056",
+    "T201",
+    "T171",
+    "T013",
+    "T190",
+    "T085",
+    "T087",
+    "T100",
+    "T042",
+    "T203",
+    "T031",
+    "T078",
+    "T047",
+    "T091",
+    "T052",
+    "T021",
+    "T017",
+    "T064",
+    "T103",
+    "T018",
+    "T098",
+    "T011",
+    "T116",
+    "T200",
+    "T012",
+    "T099",
+    "T008",
+    "T072",
+    "T041",
+    "T014",
+    "T030",
+    "T204",
+    "T016",
+    "T032",
+    "T020",
+    "T096",
+    "T097",
+    "T005",
+    "T120",
+    "T038",
+    "T191",
+    "T093",
+    "T092",
+    "T007",
+    "T019",
+    "T025",
+    "T122",
+    "T075",
+    "T046",
+    "T039",
+    "T065",
+    "T015",
+    "T114",
+    "T054",
+    "T095",
+    "T068",
+    "T063",
+    "T062",
+    "T102",
+    "T070",
+    "T033",
+    "T050",
+    "T184",
+    "T123",
+    "T034",
+    "T026",
+    "T169",
+    "T067",
+    "T024",
+    "T131",
+    "T196",
+    "T022",
+    "T023",
+}  # MEDCON types
+
+
+def default_model_path():
+    model_dir = os.path.join(CURRENT_DIR, "models/MedCAT")
+    return os.path.join(
+        model_dir,
+        [filename for filename in os.listdir(model_dir) if filename.endswith(".zip")][
+            0
+        ],
+    )
+
+
+def _model_pack_signature(model_path):
+    # The model pack is several GB, so it is identified by name, size and
+    # modification time instead of hashing its contents on every load
+    stat = os.stat(model_path)
+    return f"{os.path.basename(model_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def gt_cache_path(model_path, ground_truth_path, semantic_types=None):
+    """Path of the ground-truth CUI cache for this model pack, type-ID filter
+    and ground-truth file. Any change to one of them yields a new path."""
+    digest = hashlib.sha256()
+    digest.update(_model_pack_signature(model_path).encode())
+    digest.update(",".join(sorted(semantic_types or MEDCON_TYPE_IDS)).encode())
+    digest.update(file_sha256(ground_truth_path).encode())
+    dataset_type = os.path.basename(os.path.dirname(ground_truth_path))
+    return os.path.join(
+        CURRENT_DIR,
+        "precomputed",
+        f"medcat_gt_cuis_{dataset_type}_{digest.hexdigest()[:16]}.json",
+    )
+
+
+def load_gt_cuis(cache_path):
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path) as f:
+        return json.load(f)
+
+
+def save_gt_cuis(cache_path, gt_cuis):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(gt_cuis, f)
+    os.replace(tmp_path, cache_path)
 
 
 class MedCatScorer:
-    def __init__(self, model_path, semantic_types=None):
+    def __init__(
+        self, model_path, semantic_types=None, n_process=None, batch_size=None
+    ):
+        # n_process/batch_size are passed to CAT.get_entities_multi_texts;
+        # n_process=None extracts entities in the calling process.
+        self.n_process = n_process
+        self.batch_size = batch_size
+        # Imported here so the GT cache helpers work without loading medcat
+        from medcat.cat import CAT
+
         self.cat = CAT.load_model_pack(model_path)
         if semantic_types:
             type_ids_filter = set(semantic_types)
         else:
-            type_ids_filter = {
-                "T048",
-                "T197",
-                "T088",
-                "T055",
-                "T029",
-                "T004",
-                "T043",
-                "T101",
-                "T129",
-                "T069",
-                "T045",
-                "T079",
-                "T167",
-                "T049",
-                "T010",
-                "T080",
-                "T121",
-                "T082",
-                "T066",
-                "T040",
-                "T170",
-                "T086",
-                "T058",
-                "T130",
-                "T195",
-                "T109",
-                "T127",
-                "T037",
-                "T125",
-                "T081",
-                "T071",
-                "T061",
-                "T126",
-                "T192",
-                "T077",
-                "T073",
-                "T168",
-                "T185",
-                "T089",
-                "T074",
-                "T001",
-                "T059",
-                "T104",
-                "T083",
-                "T051",
-                "T044",
-                "T002",
-                "T194",
-                "T028",
-                "T094",
-                "T057",
-                "T053",
-                "T090",
-                "T060",
-                "T056",
-                "T201",
-                "T171",
-                "T013",
-                "T190",
-                "T085",
-                "T087",
-                "T100",
-                "T042",
-                "T203",
-                "T031",
-                "T078",
-                "T047",
-                "T091",
-                "T052",
-                "T021",
-                "T017",
-                "T064",
-                "T103",
-                "T018",
-                "T098",
-                "T011",
-                "T116",
-                "T200",
-                "T012",
-                "T099",
-                "T008",
-                "T072",
-                "T041",
-                "T014",
-                "T030",
-                "T204",
-                "T016",
-                "T032",
-                "T020",
-                "T096",
-                "T097",
-                "T005",
-                "T120",
-                "T038",
-                "T191",
-                "T093",
-                "T092",
-                "T007",
-                "T019",
-                "T025",
-                "T122",
-                "T075",
-                "T046",
-                "T039",
-                "T065",
-                "T015",
-                "T114",
-                "T054",
-                "T095",
-                "T068",
-                "T063",
-                "T062",
-                "T102",
-                "T070",
-                "T033",
-                "T050",
-                "T184",
-                "T123",
-                "T034",
-                "T026",
-                "T169",
-                "T067",
-                "T024",
-                "T131",
-                "T196",
-                "T022",
-                "T023",
-            }  # MEDCON types
+            type_ids_filter = set(MEDCON_TYPE_IDS)
         cui_filters = set()
         for type_ids in type_ids_filter:
             cui_filters.update(self.cat.cdb.addl_info["type_id2cuis"][type_ids])
         self.cat.cdb.config.linking["filters"]["cuis"] = cui_filters
 
     def get_matches(self, text):
+        return self._matches_from_entities(self.cat.get_entities(text)["entities"])
+
+    def get_matches_batch(self, texts):
+        outputs = self.cat.get_entities_multi_texts(
+            texts, n_process=self.n_process, batch_size=self.batch_size
+        )
+        return [
+            self._matches_from_entities(output.get("entities", {}))
+            for output in outputs
+        ]
+
+    def _matches_from_entities(self, entities):
         concepts = {}
         cui_list = []
-
-        entities = self.cat.get_entities(text)["entities"]
-        for ent in (
-            entities.values()
-        ):  # Fix: iterate over the values of the entities dictionary
+        for ent in entities.values():
             term = ent["pretty_name"]
             cui = ent["cui"]
             if cui not in concepts.get(term, []):
@@ -156,18 +228,34 @@ class MedCatScorer:
                 cui_list.append(cui)
         return concepts, cui_list
 
+    def get_cuis_batch(self, texts):
+        return [cuis for _, cuis in self.get_matches_batch(texts)]
+
     def score(self, reference, prediction):
         true_concept, true_cuis = self.get_matches(reference)
         pred_concept, pred_cuis = self.get_matches(prediction)
+        return self.f1(true_cuis, pred_cuis)
 
+    def score_batch(self, references, predictions, reference_cuis=None):
+        # reference_cuis (one CUI list per reference, e.g. from the ground-truth
+        # cache) skips entity extraction for the reference side.
+        if reference_cuis is None:
+            cuis = self.get_cuis_batch(list(references) + list(predictions))
+            reference_cuis = cuis[: len(references)]
+            prediction_cuis = cuis[len(references) :]
+        else:
+            prediction_cuis = self.get_cuis_batch(list(predictions))
+        return [
+            self.f1(true_cuis, pred_cuis)
+            for true_cuis, pred_cuis in zip(reference_cuis, prediction_cuis)
+        ]
+
+    @staticmethod
+    def f1(true_cuis, pred_cuis):
         try:
-            # Count correctly predicted CUIs
-            correct_predictions = sum(
-                1
-                for key in true_concept
-                for cui in true_concept[key]
-                if cui in pred_cuis
-            )
+            # Count correctly predicted CUIs; true_cuis holds one entry per
+            # unique (term, CUI) match in the reference
+            correct_predictions = sum(1 for cui in true_cuis if cui in pred_cuis)
 
             # Calculate precision, recall, and F1 score
             precision = correct_predictions / len(pred_cuis) if pred_cuis else 0
@@ -184,12 +272,45 @@ class MedCatScorer:
             return 0
 
 
+def precompute_gt_cuis(dataset_type, model_path=None):
+    model_path = model_path or default_model_path()
+    ground_truth_path = os.path.join(CURRENT_DIR, f"data/{dataset_type}/captions.csv")
+    with open(ground_truth_path) as csvfile:
+        reader = csv.reader(csvfile)
+        rows = [row for row in reader if row]
+    if rows and rows[0][0].lower() == "id":
+        rows = rows[1:]
+    scorer = MedCatScorer(
+        model_path=model_path,
+        n_process=int(os.environ.get("MEDCAT_WORKERS", "0")) or None,
+    )
+    gt_cuis = dict(
+        zip([row[0] for row in rows], scorer.get_cuis_batch([row[1] for row in rows]))
+    )
+    cache_path = gt_cache_path(model_path, ground_truth_path)
+    save_gt_cuis(cache_path, gt_cuis)
+    print(f"Saved MedCAT concepts for {len(gt_cuis)} captions to {cache_path}")
+
+
 if __name__ == "__main__":
-    import os
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Score an example pair, or precompute ground-truth MedCAT concepts."
+    )
+    parser.add_argument(
+        "--precompute",
+        choices=["valid", "test"],
+        help="Write the ground-truth CUI cache for this dataset and exit.",
+    )
+    args = parser.parse_args()
+
+    if args.precompute:
+        precompute_gt_cuis(args.precompute)
+        raise SystemExit(0)
 
-    current_dir = os.path.dirname(os.path.abspath(__file__))
     model_path = os.path.join(
-        current_dir, "models/MedCAT/umls_self_train_model_pt2ch_3760d588371755d0.zip"
+        CURRENT_DIR, "models/MedCAT/umls_self_train_model_pt2ch_3760d588371755d0.zip"
     )
 
     if not os.path.exists(model_path):
@@ -0,0 +1,154 @@
+import os
+import time
+import multiprocessing
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from checkpoint import Checkpoint
+
+# Rough resident size of each metric's models in MB, checked against the
+# memory budget before a metric is started
+METRIC_MEMORY_MB = {
+    "bert": 3600,
+    "align": 1500,
+    "rouge": 50,
+    "similarity": 1500,
+    "bleurt": 800,
+    "medcat": 4000,
+}
+# GIL-bound pure-Python metrics run in worker processes, the torch metrics
+# (which release the GIL inside their kernels) in threads
+PROCESS_METRICS = ("rouge", "medcat")
+
+_worker_evaluator = None
+
+
+def _init_worker(ground_truth_path, precision):
+    global _worker_evaluator
+    from evaluator import CaptionEvaluator
+
+    _worker_evaluator = CaptionEvaluator(
+        ground_truth_path=ground_truth_path, precision=precision
+    )
+
+
+def _worker_compute(metric, candidate_pairs, checkpoint_directory):
+    _worker_evaluator.checkpoint = (
+        Checkpoint(checkpoint_directory) if checkpoint_directory else None
+    )
+    score = _worker_evaluator._compute_metric(metric, candidate_pairs)
+    record = _worker_evaluator.profiler.stages[metric]
+    if metric in _worker_evaluator.models.load_seconds:
+        record["model_load_seconds"] = round(
+            _worker_evaluator.models.load_seconds[metric], 4
+        )
+    return score, record
+
+
+class MetricScheduler:
+    """Runs independent metrics of one submission concurrently.
+
+    Running metrics share ``cpu_budget`` CPUs: a metric counts as one CPU,
+    except ROUGE and MedCAT, which count as the worker processes they fan out
+    to (ROUGE_WORKERS, MEDCAT_WORKERS). Torch intra-op threads are split
+    between the thread metrics. A metric only starts while the estimated memory of
+    the running metrics plus its own stays within ``memory_budget_mb``
+    (0 disables the check); a metric that does not fit either budget even
+    alone still runs once nothing else is running. Each process metric keeps
+    its own worker process, so its model stays loaded between runs until
+    ``close``.
+    """
+
+    def __init__(self, evaluator, cpu_budget=None, memory_budget_mb=0):
+        self.evaluator = evaluator
+        self.cpu_budget = max(1, cpu_budget or os.cpu_count() or 1)
+        self.memory_budget_mb = memory_budget_mb
+        self.process_pools = {}
+
+    def run(self, candidate_pairs, metrics):
+        import torch
+
+        pending = list(metrics)
+        running = {}
+        scores = {}
+        thread_metrics = [m for m in pending if m not in PROCESS_METRICS]
+        torch_threads = torch.get_num_threads()
+        if thread_metrics:
+            torch.set_num_threads(
+                max(1, self.cpu_budget // min(len(thread_metrics), self.cpu_budget))
+            )
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.cpu_budget) as threads:
+                while pending or running:
+                    for metric in list(pending):
+                        if running and not self._fits(metric, running.values()):
+                            continue
+                        pending.remove(metric)
+                        running[self._submit(threads, metric, candidate_pairs)] = metric
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        metric = running.pop(future)
+                        scores[metric] = future.result()
+                        if metric in PROCESS_METRICS:
+                            # Worker processes time themselves
+                            scores[metric], record = scores[metric]
+                            self.evaluator.profiler.add(
+                                metric, dict(record, process=True)
+                            )
+                        label = self.evaluator.METRICS[metric][0]
+                        print(
+                            f"{label}: {scores[metric]} "
+                            f"(done after {time.perf_counter() - started:.1f}s)"
+                        )
+        finally:
+            torch.set_num_threads(torch_threads)
+        return scores
+
+    def close(self):
+        for pool in self.process_pools.values():
+            pool.shutdown()
+        self.process_pools = {}
+
+    def _fits(self, metric, running_metrics):
+        running_metrics = list(running_metrics)
+        cpus = sum(self._cpus(m) for m in running_metrics)
+        if cpus + self._cpus(metric) > self.cpu_budget:
+            return False
+        if not self.memory_budget_mb:
+            return True
+        used = sum(METRIC_MEMORY_MB[m] for m in running_metrics)
+        return used + METRIC_MEMORY_MB[metric] <= self.memory_budget_mb
+
+    @staticmethod
+    def _cpus(metric):
+        if metric == "rouge":
+            return max(1, int(os.environ.get("ROUGE_WORKERS", "1")))
+        if metric == "medcat":
+            return max(1, int(os.environ.get("MEDCAT_WORKERS", "0")))
+        return 1
+
+    def _submit(self, threads, metric, candidate_pairs):
+        label = self.evaluator.METRICS[metric][0]
+        print(f"Compute {label}")
+        if metric in PROCESS_METRICS:
+            if metric not in self.process_pools:
+                self.process_pools[metric] = ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(
+                        self.evaluator.ground_truth_path,
+                        self.evaluator.precision,
+                    ),
+                )
+            return self.process_pools[metric].submit(
+                _worker_compute,
+                metric,
+                candidate_pairs,
+                self.evaluator.checkpoint and self.evaluator.checkpoint.directory,
+            )
+        return threads.submit(self.evaluator._compute_metric, metric, candidate_pairs)
@@ -0,0 +1,119 @@
+import gc
+import os
+import time
+import resource
+import threading
+import contextlib
+from collections import Counter, OrderedDict
+
+
+def rss_mb():
+    """Current resident set size of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        # Peak rather than current RSS, but the best available without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ModelRegistry:
+    """Lazily loaded metric models with a shared RAM budget.
+
+    Each model is registered with a loader and an estimated size. ``get``
+    loads it on first use and records its measured resident size (the RSS
+    growth during loading). Before a load, the least recently used models are
+    unloaded until the new model's size fits within ``budget_mb``
+    (0 disables the budget). Models held through ``using`` by a metric that
+    is still scoring are never unloaded. Loads are serialized so RSS deltas
+    stay attributable to a single model, but run outside the registry lock,
+    so threads using resident models do not wait for an unrelated load.
+    """
+
+    def __init__(self, budget_mb=0):
+        self.budget_mb = budget_mb
+        self.loaders = {}
+        self.estimates_mb = {}
+        self.sizes_mb = {}
+        self.load_seconds = {}
+        self.models = OrderedDict()
+        self.in_use = Counter()
+        self.lock = threading.RLock()
+        self.load_lock = threading.Lock()
+
+    def register(self, name, loader, estimate_mb=0):
+        with self.lock:
+            self.release(name)
+            self.loaders[name] = loader
+            self.estimates_mb[name] = estimate_mb
+
+    def get(self, name):
+        with self.lock:
+            if name in self.models:
+                self.models.move_to_end(name)
+                return self.models[name]
+        with self.load_lock:
+            with self.lock:
+                # Another thread may have loaded it while we waited
+                if name in self.models:
+                    self.models.move_to_end(name)
+                    return self.models[name]
+                self._make_room(self.sizes_mb.get(name, self.estimates_mb[name]))
+                loader = self.loaders[name]
+            rss_before = rss_mb()
+            start = time.perf_counter()
+            model = loader()
+            with self.lock:
+                self.load_seconds[name] = time.perf_counter() - start
+                self.sizes_mb[name] = max(0.0, rss_mb() - rss_before)
+                self.models[name] = model
+            print(
+                f"Loaded {name} model in {self.load_seconds[name]:.1f}s "
+                f"(+{self.sizes_mb[name]:.0f} MB RSS)"
+            )
+            return model
+
+    @contextlib.contextmanager
+    def using(self, name):
+        """Keep ``name`` from being unloaded to make room while in the block."""
+        with self.lock:
+            self.in_use[name] += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_use[name] -= 1
+                if not self.in_use[name]:
+                    del self.in_use[name]
+
+    def release(self, name):
+        with self.lock:
+            if self.models.pop(name, None) is not None:
+                gc.collect()
+
+    def release_all(self):
+        with self.lock:
+            self.models.clear()
+            gc.collect()
+
+    def resident_mb(self):
+        return sum(self.sizes_mb[name] for name in self.models)
+
+    def _make_room(self, needed_mb):
+        if not self.budget_mb:
+            return
+        while self.resident_mb() + needed_mb > self.budget_mb:
+            idle = [name for name in self.models if not self.in_use[name]]
+            if not idle:
+                print(
+                    f"Model budget of {self.budget_mb} MB exceeded: the resident "
+                    "models are all in use"
+                )
+                return
+            name = idle[0]
+            del self.models[name]
+            print(
+                f"Unloading {name} model ({self.sizes_mb[name]:.0f} MB) "
+                f"to stay within the {self.budget_mb} MB model budget"
+            )
+            gc.collect()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import os
+import time
+import argparse
+import numpy as np
+from evaluator import CaptionEvaluator
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_metric(evaluator, metric, predictions):
+    # Load (and for int8 quantize) the model and the image embeddings first,
+    # so the timing covers scoring only
+    evaluator.models.get(metric)
+    if metric == "similarity":
+        evaluator._ensure_image_embeddings()
+    start = time.perf_counter()
+    scores = evaluator.metric_scores(metric, predictions)
+    elapsed = time.perf_counter() - start
+    evaluator._release_models(metric)
+    return np.asarray(scores, dtype=np.float64), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare reduced-precision model metrics against fp32: "
+        "per-metric speedup and score drift."
+    )
+    parser.add_argument("--submission", required=True, help="Path to submission.csv")
+    parser.add_argument(
+        "--dataset",
+        choices=["valid", "test"],
+        default="valid",
+        help="Dataset split to score against (default: valid).",
+    )
+    parser.add_argument(
+        "--precision",
+        choices=["int8", "bf16"],
+        default="int8",
+        help="Precision to compare against fp32 (default: int8).",
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        choices=CaptionEvaluator.TORCH_METRICS,
+        default=list(CaptionEvaluator.TORCH_METRICS),
+        help="Model metrics to compare (default: all).",
+    )
+    args = parser.parse_args()
+
+    # Measure model time, not cache lookups
+    os.environ.pop("SCORE_CACHE_PATH", None)
+    os.environ.pop("EVAL_CHECKPOINT_DIR", None)
+    ground_truth_path = os.path.join(current_dir, f"data/{args.dataset}/captions.csv")
+    reference = CaptionEvaluator(ground_truth_path=ground_truth_path, precision="fp32")
+    reduced = CaptionEvaluator(
+        ground_truth_path=ground_truth_path, precision=args.precision
+    )
+    if reduced.precision != args.precision:
+        print(f"{args.precision} is not available on this machine.")
+        raise SystemExit(1)
+    predictions = reference.load_predictions(args.submission)
+
+    rows = []
+    for metric in args.metrics:
+        fp32_scores, fp32_seconds = time_metric(reference, metric, predictions)
+        scores, seconds = time_metric(reduced, metric, predictions)
+        drift = np.abs(scores - fp32_scores)
+        rows.append(
+            (
+                metric,
+                fp32_seconds,
+                seconds,
+                fp32_seconds / seconds if seconds else float("nan"),
+                fp32_scores.mean(),
+                scores.mean(),
+                scores.mean() - fp32_scores.mean(),
+                drift.max() if len(drift) else 0.0,
+            )
+        )
+
+    print(
+        f"\nfp32 vs {args.precision} on {args.dataset} ({len(predictions)} captions)\n"
+        "Metric,fp32 s,{0} s,Speedup,fp32 mean,{0} mean,Mean drift,Max abs drift".format(
+            args.precision
+        )
+    )
+    for row in rows:
+        print("{},{:.1f},{:.1f},{:.2f}x,{:.5f},{:.5f},{:+.5f},{:.5f}".format(*row))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
+import io
 import os
 import csv
 import base64
+import hashlib
 import numpy as np
 import torch
 import sys
+import time
+import shutil
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List
 from tqdm import tqdm
+from PIL import Image
 import argparse
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -21,6 +29,12 @@ if not os.path.exists(med_image_insights_dir):
 sys.path.insert(0, med_image_insights_dir)
 
 from medimageinsightmodel import MedImageInsight
+from file_hash import file_sha256
+from embedding_store import (
+    PRECOMPUTED_DIR,
+    load_embedding_store,
+    save_embedding_store,
+)
 
 
 def load_image_ids(dataset_type: str) -> List[str]:
@@ -36,55 +50,311 @@ def load_image_ids(dataset_type: str) -> List[str]:
     return image_ids
 
 
-def encode_batch(image_paths: List[str], scorer: MedImageInsight):
-    with open(image_paths[0], "rb") as f:
-        pass  # quick existence check to surface early errors
-
+def read_batch(image_paths: List[str], prepare=None):
+    """Image files, passed through ``prepare`` if given (raw bytes
+    otherwise), and the SHA-256 of each file."""
     images = []
+    hashes = []
     for p in image_paths:
         if not os.path.exists(p):
             raise FileNotFoundError(f"Image file not found: {p}")
         with open(p, "rb") as f:
-            images.append(base64.b64encode(f.read()).decode("utf-8"))
+            data = f.read()
+        images.append(prepare(data) if prepare else data)
+        hashes.append(hashlib.sha256(data).hexdigest())
+    return images, hashes
+
+
+def prefetch_batches(path_batches, workers: int = 4, prefetch: int = 4, prepare=None):
+    """Yield read_batch() of each batch in order while up to ``prefetch``
+    following batches are read and prepared by ``workers`` threads."""
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        batches = iter(path_batches)
+        pending = deque(
+            pool.submit(read_batch, paths, prepare)
+            for _, paths in zip(range(max(1, prefetch)), batches)
+        )
+        while pending:
+            future = pending.popleft()
+            paths = next(batches, None)
+            if paths is not None:
+                pending.append(pool.submit(read_batch, paths, prepare))
+            yield future.result()
+
+
+def encode_batch(image_paths: List[str], scorer: MedImageInsight, handoff="base64"):
+    images = read_batch(image_paths, image_preparer(scorer, handoff))[0]
+    return encode_images(images, scorer, handoff)
+
+
+def resolve_handoff(scorer: MedImageInsight, handoff: str) -> str:
+    """``handoff``, or "base64" when the scorer does not expose the
+    preprocessing and image encoder that the direct path calls."""
+    if handoff == "direct" and not (
+        callable(getattr(scorer, "preprocess", None))
+        and hasattr(getattr(scorer, "model", None), "encode_image")
+    ):
+        print("MedImageInsight has no preprocess/encode_image; using base64 hand-off")
+        return "base64"
+    return handoff
+
+
+def image_preparer(scorer: MedImageInsight, handoff: str = "base64"):
+    """Per-image work done on the reader threads, so it overlaps with encoding.
 
+    The "direct" hand-off decodes each file and applies the model's own
+    preprocessing, as ``scorer.encode`` does after decoding base64, without
+    the base64 round trip; "base64" only encodes the file for
+    ``scorer.encode``.
+    """
+    if handoff == "direct":
+        return lambda data: scorer.preprocess(
+            Image.open(io.BytesIO(data)).convert("RGB")
+        )
+    return lambda data: base64.b64encode(data).decode("utf-8")
+
+
+def encode_images(images, scorer: MedImageInsight, handoff="base64"):
+    """Embeddings of images prepared by ``image_preparer(scorer, handoff)``."""
     with torch.inference_mode():
-        outputs = scorer.encode(images=images)
-        image_vecs = outputs["image_embeddings"]
+        if handoff == "direct":
+            pixels = torch.stack(list(images)).to(getattr(scorer, "device", "cpu"))
+            image_vecs = scorer.model.encode_image(pixels)
+        else:
+            outputs = scorer.encode(images=images)
+            image_vecs = outputs["image_embeddings"]
         if hasattr(image_vecs, "detach"):
             image_vecs = image_vecs.detach().cpu().numpy()
     return image_vecs
 
 
 def encode_dataset_images(
-    dataset_type: str, scorer: MedImageInsight, batch_size: int = 32
+    dataset_type: str,
+    scorer: MedImageInsight,
+    batch_size: int = 32,
+    workers: int = 4,
+    prefetch: int = 4,
+    image_ids: List[str] = None,
+    desc: str = None,
+    handoff: str = "base64",
 ):
+    """Embeddings and file hashes of ``image_ids`` (default: the whole split)."""
     image_dir = os.path.join(current_dir, f"data/{dataset_type}/images")
-    image_ids = load_image_ids(dataset_type)
+    handoff = resolve_handoff(scorer, handoff)
+    if image_ids is None:
+        image_ids = load_image_ids(dataset_type)
     embeddings = {}
+    hashes = {}
 
-    for start in tqdm(
-        range(0, len(image_ids), batch_size), desc=f"Encoding {dataset_type}"
-    ):
-        batch_ids = image_ids[start : start + batch_size]
-        batch_paths = [
-            os.path.join(image_dir, image_id + ".jpg") for image_id in batch_ids
-        ]
-        image_vecs = encode_batch(batch_paths, scorer)
-        for image_id, vec in zip(batch_ids, image_vecs):
+    id_batches = [
+        image_ids[start : start + batch_size]
+        for start in range(0, len(image_ids), batch_size)
+    ]
+    path_batches = (
+        [os.path.join(image_dir, image_id + ".jpg") for image_id in batch_ids]
+        for batch_ids in id_batches
+    )
+    # Images are read and prepared (decoded and preprocessed for the direct
+    # hand-off) by background threads while the model encodes, so the time
+    # spent waiting for them shows whether reading or decoding limits a run.
+    started = time.perf_counter()
+    read_wait = 0.0
+    progress = tqdm(
+        total=len(image_ids), desc=desc or f"Encoding {dataset_type}", unit="img"
+    )
+    batches = prefetch_batches(
+        path_batches, workers, prefetch, image_preparer(scorer, handoff)
+    )
+    for batch_ids in id_batches:
+        wait_start = time.perf_counter()
+        images, batch_hashes = next(batches)
+        read_wait += time.perf_counter() - wait_start
+        image_vecs = encode_images(images, scorer, handoff)
+        for image_id, vec, digest in zip(batch_ids, image_vecs, batch_hashes):
             embeddings[image_id] = vec
+            hashes[image_id] = digest
+        progress.update(len(batch_ids))
+    progress.close()
 
-    return embeddings
+    elapsed = time.perf_counter() - started
+    print(
+        f"Encoded {len(embeddings)} images in {elapsed:.1f}s "
+        f"({len(embeddings) / elapsed if elapsed else 0:.1f} images/sec, "
+        f"{read_wait:.1f}s waiting for image reads; "
+        f"{workers} read workers, prefetch {prefetch} batches, {handoff} hand-off)"
+    )
+    return embeddings, hashes
 
 
-def save_embeddings(dataset_type: str, embeddings):
-    os.makedirs(os.path.join(current_dir, "precomputed"), exist_ok=True)
-    save_path = os.path.join(
-        current_dir, "precomputed", f"image_embeddings_{dataset_type}.npz"
+def save_embeddings(dataset_type: str, embeddings, hashes=None):
+    if not embeddings:
+        print(f"No images found for {dataset_type}; nothing to save.")
+        return
+    save_path = save_embedding_store(
+        dataset_type,
+        list(embeddings),
+        np.stack(list(embeddings.values())),
+        hashes=hashes,
     )
-    np.savez(save_path, **embeddings)
     print(f"Saved {len(embeddings)} embeddings for {dataset_type} to {save_path}")
 
 
+def diff_store(dataset_type: str, store, workers: int = 4):
+    """IDs of the split to (re-)encode against an existing store, and the
+    current hash of every image file in the split."""
+    image_dir = os.path.join(current_dir, f"data/{dataset_type}/images")
+    image_ids = load_image_ids(dataset_type)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        hashes = dict(
+            zip(
+                image_ids,
+                pool.map(
+                    file_sha256,
+                    [os.path.join(image_dir, i + ".jpg") for i in image_ids],
+                ),
+            )
+        )
+    new_ids = [i for i in image_ids if i not in store]
+    changed_ids = [
+        i
+        for i in image_ids
+        if i in store and i in store.hashes and store.hashes[i] != hashes[i]
+    ]
+    unhashed = sum(1 for i in image_ids if i in store and i not in store.hashes)
+    split_ids = set(image_ids)
+    stale = sum(1 for i in store.ids if i not in split_ids)
+    print(
+        f"{dataset_type}: {len(new_ids)} new, {len(changed_ids)} changed, "
+        f"{len(image_ids) - len(new_ids) - len(changed_ids)} unchanged images; "
+        f"{stale} stored embeddings are no longer in the split and are kept"
+    )
+    if unhashed:
+        print(
+            f"{unhashed} stored embeddings have no recorded image hash; they are "
+            "kept as is and their current hashes are recorded."
+        )
+    return new_ids + changed_ids, hashes
+
+
+def update_store(dataset_type: str, store, embeddings, hashes):
+    """Write ``store`` with changed rows replaced and new rows appended."""
+    ids = list(store.ids)
+    # Copy out of the memory map before the file is replaced
+    matrix = np.array(store.matrix)
+    new_ids = []
+    for image_id, vec in embeddings.items():
+        if image_id in store:
+            matrix[store.index[image_id]] = vec
+        else:
+            new_ids.append(image_id)
+    if new_ids:
+        matrix = np.concatenate(
+            [matrix, np.stack([embeddings[i] for i in new_ids]).astype(matrix.dtype)]
+        )
+        ids.extend(new_ids)
+    save_path = save_embedding_store(
+        dataset_type, ids, matrix, hashes={**store.hashes, **hashes}
+    )
+    print(
+        f"Updated {len(embeddings) - len(new_ids)} and added {len(new_ids)} "
+        f"embeddings for {dataset_type} in {save_path}"
+    )
+
+
+def load_scorer(device: str) -> MedImageInsight:
+    scorer = MedImageInsight(
+        model_dir=os.path.join(current_dir, "MedImageInsights/2024.09.27"),
+        vision_model_name="medimageinsigt-v1.0.0.pt",
+        language_model_name="language_model.pth",
+    )
+    scorer.load_model()
+    # load_model puts the model on CUDA whenever it is available, so move it
+    # to the requested device; encode places its inputs on scorer.device
+    if getattr(scorer, "model", None) is None:
+        raise RuntimeError("MedImageInsight did not load a model to move to " + device)
+    scorer.model.to(device)
+    scorer.device = torch.device(device)
+    print(f"MedImageInsight device: {device}")
+    return scorer
+
+
+def _encode_part(dataset_type, image_ids, part, shard_dir, device, torch_threads, kw):
+    # Runs in a worker process with its own model; writes its embeddings to
+    # a shard store so results do not travel back through a pipe
+    torch.set_num_threads(torch_threads)
+    scorer = load_scorer(device)
+    embeddings, hashes = encode_dataset_images(
+        dataset_type,
+        scorer,
+        image_ids=image_ids,
+        desc=f"Encoding {dataset_type} part {part}",
+        **kw,
+    )
+    save_embedding_store(
+        f"{dataset_type}_part{part}",
+        list(embeddings),
+        np.stack(list(embeddings.values())),
+        directory=shard_dir,
+        hashes=hashes,
+    )
+    return part
+
+
+def encode_with_workers(
+    dataset_type: str,
+    image_ids: List[str],
+    processes: int,
+    device: str,
+    torch_threads: int,
+    **kw,
+):
+    """Split ``image_ids`` into ``processes`` contiguous parts encoded by
+    separate processes, then merge their shard stores in ``image_ids`` order."""
+    if not image_ids:
+        return {}, {}
+    shard_dir = os.path.join(PRECOMPUTED_DIR, f"shards_{dataset_type}")
+    os.makedirs(shard_dir, exist_ok=True)
+    size = max(1, -(-len(image_ids) // processes))
+    parts = [
+        image_ids[start : start + size] for start in range(0, len(image_ids), size)
+    ]
+    started = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=len(parts), mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        futures = [
+            pool.submit(
+                _encode_part,
+                dataset_type,
+                part_ids,
+                part,
+                shard_dir,
+                device,
+                torch_threads,
+                kw,
+            )
+            for part, part_ids in enumerate(parts)
+        ]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    embeddings = {}
+    hashes = {}
+    for part in range(len(parts)):
+        shard = load_embedding_store(f"{dataset_type}_part{part}", shard_dir)
+        for image_id in shard.ids:
+            embeddings[image_id] = np.array(shard[image_id])
+        hashes.update(shard.hashes)
+    shutil.rmtree(shard_dir)
+    print(
+        f"{len(parts)} processes encoded {len(embeddings)} images in {elapsed:.1f}s "
+        f"({len(embeddings) / elapsed if elapsed else 0:.1f} images/sec overall, "
+        f"{torch_threads} torch threads each, on {device})"
+    )
+    return embeddings, hashes
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Precompute image embeddings for a dataset."
@@ -95,28 +365,110 @@ def main():
         default="valid",
         help="Dataset to precompute embeddings for (default: valid).",
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=32,
+        help="Images per model batch (default: 32).",
+    )
+    parser.add_argument(
+        "--read-workers",
+        type=int,
+        default=4,
+        help="Threads reading and preparing images (default: 4).",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=4,
+        help="Batches read ahead of the one being encoded (default: 4).",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only encode images that are new or whose file changed since the "
+        "existing store was written, and add them to it.",
+    )
+    parser.add_argument(
+        "--device",
+        choices=["auto", "cuda", "cpu"],
+        default="auto",
+        help="Device for MedImageInsight (default: cuda if available, else cpu).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes, each with its own model, that encode a share of the "
+        "images (default: 1).",
+    )
+    parser.add_argument(
+        "--torch-threads",
+        type=int,
+        default=0,
+        help="torch threads per worker process (default: CPU cores / workers).",
+    )
+    parser.add_argument(
+        "--image-handoff",
+        choices=["direct", "base64"],
+        default="base64",
+        help="base64-encode images for MedImageInsight.encode (base64, default) "
+        "or pass decoded images straight to the model's preprocessing (direct; "
+        "check it with benchmarks/image_handoff.py first).",
+    )
     args = parser.parse_args()
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    assert device == "cuda", "GPU is required for MedImageInsight model."
-    scorer = MedImageInsight(
-        model_dir=os.path.join(current_dir, "MedImageInsights/2024.09.27"),
-        vision_model_name="medimageinsigt-v1.0.0.pt",
-        language_model_name="language_model.pth",
-    )
-    scorer.load_model()
-    if hasattr(scorer, "device"):
-        scorer.device = device
-    if hasattr(scorer, "to"):
-        try:
-            scorer.to(device)
-        except Exception:
-            pass
-    print(f"MedImageInsight device: {device}")
+    store = None
+    image_ids = None
+    if args.incremental:
+        store = load_embedding_store(args.dataset)
+        if store is None:
+            print(f"No embeddings stored for {args.dataset} yet; encoding all images.")
+        else:
+            image_ids, hashes = diff_store(args.dataset, store, args.read_workers)
+            if not image_ids:
+                if any(image_id not in store.hashes for image_id in hashes):
+                    update_store(args.dataset, store, {}, hashes)
+                print(f"Embeddings for {args.dataset} are up to date.")
+                return
+
+    device = args.device
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    elif device == "cuda" and not torch.cuda.is_available():
+        print("CUDA is not available; use --device cpu.")
+        sys.exit(1)
 
     print(f"Precomputing embeddings for {args.dataset}...")
-    embeddings = encode_dataset_images(args.dataset, scorer)
-    save_embeddings(args.dataset, embeddings)
+    kw = dict(
+        batch_size=args.batch_size,
+        workers=args.read_workers,
+        prefetch=args.prefetch,
+        handoff=args.image_handoff,
+    )
+    if args.workers > 1:
+        torch_threads = args.torch_threads or max(
+            1, (os.cpu_count() or 1) // args.workers
+        )
+        embeddings, embedding_hashes = encode_with_workers(
+            args.dataset,
+            image_ids or load_image_ids(args.dataset),
+            args.workers,
+            device,
+            torch_threads,
+            **kw,
+        )
+    else:
+        if args.torch_threads:
+            torch.set_num_threads(args.torch_threads)
+        scorer = load_scorer(device)
+        embeddings, embedding_hashes = encode_dataset_images(
+            args.dataset, scorer, image_ids=image_ids, **kw
+        )
+    if store is not None:
+        update_store(args.dataset, store, embeddings, {**hashes, **embedding_hashes})
+    else:
+        save_embeddings(args.dataset, embeddings, embedding_hashes)
 
 
 if __name__ == "__main__":
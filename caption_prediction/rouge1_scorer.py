@@ -0,0 +1,65 @@
+import re
+from collections import Counter
+from multiprocessing import Pool
+
+# Same tokenization as rouge_score's DefaultTokenizer without a stemmer.
+NON_ALPHANUM_RE = re.compile(r"[^a-z0-9]+")
+SPACES_RE = re.compile(r"\s+")
+VALID_TOKEN_RE = re.compile(r"^[a-z0-9]+$")
+
+
+def tokenize(text):
+    text = NON_ALPHANUM_RE.sub(" ", text.lower())
+    return [token for token in SPACES_RE.split(text) if VALID_TOKEN_RE.match(token)]
+
+
+def rouge1_fmeasure(reference_counts, prediction_counts):
+    reference_total = sum(reference_counts.values())
+    prediction_total = sum(prediction_counts.values())
+    overlap = sum(
+        min(count, prediction_counts[token])
+        for token, count in reference_counts.items()
+        if token in prediction_counts
+    )
+    precision = overlap / max(prediction_total, 1)
+    recall = overlap / max(reference_total, 1)
+    if precision + recall > 0:
+        return 2 * precision * recall / (precision + recall)
+    return 0.0
+
+
+def _score_chunk(pairs):
+    return [
+        rouge1_fmeasure(Counter(tokenize(reference)), Counter(tokenize(prediction)))
+        for reference, prediction in pairs
+    ]
+
+
+class Rouge1Scorer:
+    """Offline ROUGE-1 F-measure, equal to rouge_score's rouge1 fmeasure
+    with use_stemmer=False."""
+
+    def __init__(self, workers=1, min_pairs_per_worker=5000):
+        self.workers = max(1, workers)
+        self.min_pairs_per_worker = min_pairs_per_worker
+
+    def score(self, references, predictions):
+        pairs = list(zip(references, predictions))
+        workers = min(self.workers, len(pairs) // self.min_pairs_per_worker)
+        if workers <= 1:
+            return _score_chunk(pairs)
+        chunk_size = -(-len(pairs) // workers)
+        chunks = [
+            pairs[start : start + chunk_size]
+            for start in range(0, len(pairs), chunk_size)
+        ]
+        with Pool(workers) as pool:
+            results = pool.map(_score_chunk, chunks)
+        return [score for chunk in results for score in chunk]
+
+
+if __name__ == "__main__":
+    scorer = Rouge1Scorer()
+    reference = "The patient was diagnosed with pneumonia."
+    prediction = "The patient has pneumonia."
+    print(f"ROUGE-1 F: {scorer.score([reference], [prediction])[0]}")
@@ -1,25 +1,183 @@
 #!/usr/bin/env python3
 import sys
 import os
+import csv
 import json
+import argparse
 import traceback
 from evaluator import CaptionEvaluator
+from instrumentation import write_profile
+from sharding import merge_shards, parse_shard, score_shard, shard_path, write_shard
 from submission_check import check_submission, SubmissionFormatError
 
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python run_evaluation.py [valid|test]")
+def _submission_name(submission_path):
+    # <name>/submission.csv -> <name>, <name>.csv -> <name>
+    if os.path.basename(submission_path) == "submission.csv":
+        return os.path.basename(os.path.dirname(os.path.abspath(submission_path)))
+    return os.path.splitext(os.path.basename(submission_path))[0]
+
+
+def _collect_submissions(paths):
+    submissions = []
+    for path in paths:
+        if os.path.isdir(path):
+            for entry in sorted(os.listdir(path)):
+                entry_path = os.path.join(path, entry)
+                if os.path.isdir(entry_path):
+                    entry_path = os.path.join(entry_path, "submission.csv")
+                    if not os.path.exists(entry_path):
+                        continue
+                elif not entry.endswith(".csv"):
+                    continue
+                submissions.append(entry_path)
+        else:
+            submissions.append(path)
+    return submissions
+
+
+def run_batch(
+    dataset_type, ground_truth_path, submission_paths, output_dir, metrics=None
+):
+    submissions = {}
+    for submission_path in _collect_submissions(submission_paths):
+        name = _submission_name(submission_path)
+        if name in submissions:
+            print(f"Error: Two submissions are named '{name}'")
+            sys.exit(1)
+        submissions[name] = submission_path
+    print(f"Found {len(submissions)} submissions")
+
+    valid = {}
+    for name, submission_path in submissions.items():
+        try:
+            check_submission(
+                submission_path=submission_path,
+                ground_truth_path=ground_truth_path,
+                dataset_type=dataset_type,
+            )
+            valid[name] = submission_path
+        except SubmissionFormatError as e:
+            print(f"Submission format error detected in {name}:\n" + str(e))
+        except Exception:
+            print(f"Unexpected error during submission check of {name}:")
+            traceback.print_exc()
+    print(f"{len(valid)} of {len(submissions)} submissions passed the format check.")
+    if not valid:
         sys.exit(1)
 
-    dataset_type = sys.argv[1].lower()
+    caption_evaluator = CaptionEvaluator(
+        ground_truth_path=ground_truth_path, metrics=metrics
+    )
+    results = caption_evaluator.evaluate_many(list(valid.values()))
+    caption_evaluator.close()
 
-    if dataset_type not in ["valid", "test"]:
-        print("Error: Argument must be either 'valid' or 'test'")
+    rows = []
+    for name, submission_path in valid.items():
+        result = results[submission_path]
+        scores_output_path = os.path.join(output_dir, name, "scores.json")
+        os.makedirs(os.path.dirname(scores_output_path), exist_ok=True)
+        with open(scores_output_path, "w") as f:
+            json.dump(result, f, indent=2)
+        rows.append(dict(submission=name, **result))
+    combined_output_path = os.path.join(output_dir, "scores.csv")
+    with open(combined_output_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    write_profile(
+        caption_evaluator.last_profile, os.path.join(output_dir, "profile.json")
+    )
+    print(f"\nScores for {len(rows)} submissions written to {output_dir}")
+    if len(valid) != len(submissions):
         sys.exit(1)
 
+
+def run_merge(ground_truth_path, shard_paths, output_dir):
+    try:
+        # Shard IDs come from CaptionEvaluator.load_gt, so parse the same way
+        ground_truth_ids = CaptionEvaluator.read_ground_truth(ground_truth_path)
+        scores = merge_shards(shard_paths, list(ground_truth_ids))
+    except (OSError, IndexError, StopIteration, ValueError) as e:
+        print(f"Error: Cannot merge shards: {e}")
+        sys.exit(1)
+    result = CaptionEvaluator._build_result(scores)
+    print(f"\nMerged {len(shard_paths)} shards")
+    print(result)
+    scores_output_path = os.path.join(output_dir, "scores.json")
+    os.makedirs(output_dir, exist_ok=True)
+    with open(scores_output_path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nScores written to {scores_output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check and evaluate caption prediction submissions."
+    )
+    parser.add_argument(
+        "dataset", type=str.lower, choices=["valid", "test"], help="Dataset split."
+    )
+    parser.add_argument(
+        "--submissions",
+        nargs="+",
+        help="Evaluate several submissions at once: submission .csv files, or "
+        "directories holding .csv files or <name>/submission.csv entries.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="/app/output",
+        help="Directory for scores.json (default: /app/output).",
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        choices=["all", "bert", "align", "rouge", "similarity", "bleurt", "medcat"],
+        help="Only compute these metrics (default: EVAL_METRICS or all). "
+        "Relevance and factuality then average the computed metrics and the "
+        "result is marked partial.",
+    )
+    parser.add_argument(
+        "--shard",
+        help="Score only shard i of N (1-based, e.g. 2/4) and write its "
+        "per-image scores to <output-dir>/shard_<i>_of_<N>.json.",
+    )
+    parser.add_argument(
+        "--merge",
+        nargs="+",
+        metavar="SHARD",
+        help="Merge shard_<i>_of_<N>.json files into scores.json.",
+    )
+    args = parser.parse_args()
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+
+    dataset_type = args.dataset
+
     current_dir = os.path.dirname(os.path.abspath(__file__))
     ground_truth_path = os.path.join(current_dir, f"data/{dataset_type}/captions.csv")
+    if args.merge:
+        if not os.path.exists(ground_truth_path):
+            print(f"Error: Ground truth file not found at {ground_truth_path}")
+            sys.exit(1)
+        run_merge(ground_truth_path, args.merge, args.output_dir)
+        return
+    if args.submissions:
+        if not os.path.exists(ground_truth_path):
+            print(f"Error: Ground truth file not found at {ground_truth_path}")
+            sys.exit(1)
+        run_batch(
+            dataset_type,
+            ground_truth_path,
+            args.submissions,
+            args.output_dir,
+            metrics=args.metrics,
+        )
+        return
+
     # submission is mounted into /app/submission.csv per README
     submission_file_path = os.path.join(current_dir, "submission.csv")
 
@@ -52,22 +210,42 @@ def main():
         traceback.print_exc()
         sys.exit(1)
 
-    caption_evaluator = CaptionEvaluator(ground_truth_path=ground_truth_path)
+    caption_evaluator = CaptionEvaluator(
+        ground_truth_path=ground_truth_path, metrics=args.metrics
+    )
+    if args.shard:
+        shard_output_path = shard_path(args.output_dir, *shard)
+        write_shard(
+            score_shard(caption_evaluator, submission_file_path, *shard),
+            shard_output_path,
+        )
+        write_profile(
+            caption_evaluator.last_profile,
+            os.path.splitext(shard_output_path)[0] + ".profile.json",
+        )
+        print(f"\nShard {args.shard} scores written to {shard_output_path}")
+        return
     _client_payload = {"submission_file_path": submission_file_path}
     _context = {}
 
     result = caption_evaluator._evaluate(_client_payload, _context)
+    caption_evaluator.close()
     print(f"\nEvaluation complete for {dataset_type} dataset!")
     print(result)
 
     # Write scores.json for AI4MediaBench platform
-    scores_output_path = os.path.join("/app/output", "scores.json")
+    scores_output_path = os.path.join(args.output_dir, "scores.json")
     # create output directory if it doesn't exist
     os.makedirs(os.path.dirname(scores_output_path), exist_ok=True)
     with open(scores_output_path, "w") as f:
         json.dump(result, f, indent=2)
     print(f"\nScores written to {scores_output_path}")
 
+    # Per-stage timings and memory, kept out of scores.json
+    profile_output_path = os.path.join(args.output_dir, "profile.json")
+    write_profile(caption_evaluator.last_profile, profile_output_path)
+    print(f"Profile written to {profile_output_path}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,83 @@
+import time
+import sqlite3
+import threading
+
+
+class ScoreCache:
+    """Per-caption metric scores stored in SQLite across evaluation runs.
+
+    Entries are keyed by (metric, model identifier, image ID, caption hash)
+    and hold the exact float the model produced, so hits are bit-identical.
+    The caption hash also covers the reference the caption was scored
+    against (and the image embedding for similarity).
+    When the cache grows beyond ``max_entries`` the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, path, max_entries=1000000):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "metric TEXT, model TEXT, image_id TEXT, caption_hash TEXT, "
+                "score REAL, last_used REAL, "
+                "PRIMARY KEY (metric, model, image_id, caption_hash))"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)"
+            )
+
+    def get_many(self, metric, model, entries):
+        """Return {(image_id, caption_hash): score} for the cached entries."""
+        found = {}
+        with self.lock:
+            for image_id, caption_hash in entries:
+                row = self.conn.execute(
+                    "SELECT score FROM scores WHERE metric = ? AND model = ? "
+                    "AND image_id = ? AND caption_hash = ?",
+                    (metric, model, image_id, caption_hash),
+                ).fetchone()
+                if row is not None:
+                    found[(image_id, caption_hash)] = row[0]
+            now = time.time()
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE scores SET last_used = ? WHERE metric = ? AND model = ? "
+                    "AND image_id = ? AND caption_hash = ?",
+                    [(now, metric, model, *key) for key in found],
+                )
+            hits, misses = self.stats.get(metric, (0, 0))
+            self.stats[metric] = (
+                hits + len(found),
+                misses + len(entries) - len(found),
+            )
+        return found
+
+    def put_many(self, metric, model, rows):
+        """Store (image_id, caption_hash, score) rows, then evict LRU entries."""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (metric, model, image_id, caption_hash, float(score), now)
+                    for image_id, caption_hash, score in rows
+                ],
+            )
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM scores").fetchone()
+            if count > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM scores WHERE rowid IN (SELECT rowid FROM scores "
+                    "ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def print_stats(self):
+        for metric, (hits, misses) in self.stats.items():
+            total = hits + misses
+            rate = 100.0 * hits / total if total else 0.0
+            print(f"Score cache {metric}: {hits} hits, {misses} misses ({rate:.1f}%)")
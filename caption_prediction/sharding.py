@@ -0,0 +1,126 @@
+import os
+import json
+import numpy as np
+from file_hash import file_sha256
+
+
+def parse_shard(value):
+    """'i/N' -> (i, N) with 1 <= i <= N."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Expected --shard i/N, got '{value}'")
+    if not 1 <= index <= count:
+        raise ValueError(f"Shard index must be between 1 and {count}, got {index}")
+    return index, count
+
+
+def shard_ids(image_ids, index, count):
+    """Deterministic round-robin slice of the sorted image IDs."""
+    return set(sorted(image_ids)[index - 1 :: count])
+
+
+def shard_path(output_dir, index, count):
+    return os.path.join(output_dir, f"shard_{index}_of_{count}.json")
+
+
+def score_shard(evaluator, submission_file_path, index, count, metrics=None):
+    """Per-image scores of the images in shard ``index`` of ``count``.
+
+    Each image keeps its position in the submission, so merging the shards
+    averages the scores in the same order as a single-node run. A shard
+    left empty because ``count`` exceeds the number of images has no scores.
+    """
+    metrics = evaluator._select_metrics(metrics)
+    scores = {}
+    with evaluator._submission_run(submission_file_path) as predictions:
+        selected = shard_ids(predictions, index, count)
+        positions = [
+            i for i, image_id in enumerate(predictions) if image_id in selected
+        ]
+        image_ids = list(predictions)
+        pairs = {image_ids[i]: predictions[image_ids[i]] for i in positions}
+        print(f"Shard {index}/{count}: {len(pairs)} of {len(predictions)} images")
+        for metric in metrics:
+            if not pairs:
+                scores[metric] = []
+                continue
+            label = evaluator.METRICS[metric][0]
+            print(f"Compute {label}")
+            with evaluator.profiler.stage(metric, items=len(pairs)):
+                scores[metric] = [
+                    float(score) for score in evaluator.metric_scores(metric, pairs)
+                ]
+    return {
+        "dataset": evaluator.dataset_type,
+        "shard": [index, count],
+        "submission_sha256": file_sha256(submission_file_path),
+        "ground_truth_sha256": file_sha256(evaluator.ground_truth_path),
+        "image_ids": list(pairs),
+        "positions": positions,
+        "scores": scores,
+    }
+
+
+def write_shard(shard, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(shard, f)
+    os.replace(path + ".tmp", path)
+
+
+def merge_shards(shard_paths, ground_truth_ids):
+    """Metric means over all shards, as a single-node run computes them.
+
+    Checks that the shards come from one submission and split, that every
+    shard of the split is present and that together they cover every
+    ground truth image exactly once.
+    """
+    shards = []
+    for path in shard_paths:
+        with open(path) as f:
+            shards.append(json.load(f))
+    if not shards:
+        raise ValueError("No shard files given.")
+    first = shards[0]
+    for key in ("dataset", "submission_sha256", "ground_truth_sha256"):
+        if any(shard[key] != first[key] for shard in shards):
+            raise ValueError(f"Shards disagree on {key}; they are not from one run.")
+    count = first["shard"][1]
+    indices = sorted(shard["shard"][0] for shard in shards)
+    if any(shard["shard"][1] != count for shard in shards):
+        raise ValueError("Shards were split with different shard counts.")
+    if indices != list(range(1, count + 1)):
+        missing = sorted(set(range(1, count + 1)) - set(indices))
+        duplicate = sorted({i for i in indices if indices.count(i) > 1})
+        raise ValueError(
+            f"Incomplete shard set for {count} shards: missing {missing}, "
+            f"duplicate {duplicate}."
+        )
+    metrics = list(first["scores"])
+    if any(list(shard["scores"]) != metrics for shard in shards):
+        raise ValueError("Shards computed different metrics.")
+
+    positions = {}
+    for shard in shards:
+        for image_id, position in zip(shard["image_ids"], shard["positions"]):
+            if image_id in positions:
+                raise ValueError(f"Image ID '{image_id}' is in more than one shard.")
+            positions[image_id] = position
+    missing = set(ground_truth_ids) - set(positions)
+    extra = set(positions) - set(ground_truth_ids)
+    if missing or extra:
+        raise ValueError(
+            f"Shards cover {len(positions)} images but the ground truth has "
+            f"{len(ground_truth_ids)}: {len(missing)} missing, {len(extra)} unknown."
+        )
+
+    scores = {}
+    for metric in metrics:
+        per_image = [
+            (position, score)
+            for shard in shards
+            for position, score in zip(shard["positions"], shard["scores"][metric])
+        ]
+        scores[metric] = np.mean([score for _, score in sorted(per_image)])
+    return scores